@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+'''
+This module benchmarks the redaction paths of filtered_logger:
+- filter_datum
+- RedactingFormatter (string and structured modes)
+- export_users, the path behind main(), on an in-memory SQLite table
+
+Usage:
+    ./benchmark.py [--messages N] [--fields N] [--length N]
+                   [--pii-density F] [--rows N] [--json]
+'''
+
+import argparse
+import io
+import json
+import logging
+import random
+import sqlite3
+import string
+import sys
+import time
+from typing import Callable, Dict, List, Sequence
+
+from filtered_logger import (PII_FIELDS, RedactingFormatter, export_users,
+                             filter_datum)
+
+
+def make_messages(
+        count: int,
+        fields: int = 5,
+        length: int = 120,
+        pii_density: float = 0.5,
+        seed: int = 0,
+) -> List[str]:
+    '''
+    Returns synthetic "key=value;" log messages.
+    Args:
+        count: an integer, the number of messages.
+        fields: an integer, the key=value pairs per message.
+        length: an integer, the minimum message length in characters.
+        pii_density: a float, the probability that a pair is PII.
+        seed: an integer, the random seed.
+    Returns:
+        A list of strings.
+    '''
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        pairs = []
+        for i in range(fields):
+            if rng.random() < pii_density:
+                key = rng.choice(PII_FIELDS)
+            else:
+                key = "field{}".format(i)
+            value = "".join(rng.choices(string.ascii_letters, k=8))
+            pairs.append("{}={};".format(key, value))
+        message = "".join(pairs)
+        if len(message) < length:
+            message += "pad=" + "x" * (length - len(message)) + ";"
+        messages.append(message)
+    return messages
+
+
+def make_users_db(
+        rows: int,
+        fields: int = 5,
+        pii_density: float = 0.5,
+        seed: int = 0,
+) -> sqlite3.Connection:
+    '''
+    Returns an in-memory SQLite connection holding a users table.
+    Args:
+        rows: an integer, the number of rows.
+        fields: an integer, the number of columns.
+        pii_density: a float, the share of columns named after PII_FIELDS.
+        seed: an integer, the random seed.
+    Returns:
+        A sqlite3.Connection object.
+    '''
+    rng = random.Random(seed)
+    pii = min(len(PII_FIELDS), round(fields * pii_density))
+    columns = list(PII_FIELDS[:pii]) + [
+        "column{}".format(i) for i in range(fields - pii)]
+    db_connector = sqlite3.connect(":memory:")
+    db_connector.execute("CREATE TABLE users ({});".format(
+        ", ".join("{} TEXT".format(column) for column in columns)))
+    db_connector.executemany(
+        "INSERT INTO users VALUES ({});".format(
+            ", ".join("?" * len(columns))),
+        ([("".join(rng.choices(string.ascii_letters, k=10)))
+          for _ in columns] for _ in range(rows)))
+    db_connector.commit()
+    return db_connector
+
+
+def percentile(samples: Sequence[float], fraction: float) -> float:
+    '''
+    Returns the nearest-rank percentile of sorted samples.
+    Args:
+        samples: a sorted sequence of floats.
+        fraction: a float between 0 and 1.
+    Returns:
+        A float.
+    '''
+    if not samples:
+        return 0.0
+    rank = min(len(samples) - 1, max(0, int(fraction * len(samples))))
+    return samples[rank]
+
+
+def measure(name: str, call: Callable, inputs: Sequence,
+            items_per_call: int = 1, bytes_per_call: Sequence = ()) -> Dict:
+    '''
+    Times call(x) for every x in inputs.
+    Args:
+        name: a string, the path being measured.
+        call: a callable taking one input.
+        inputs: a sequence of inputs.
+        items_per_call: an integer, messages handled by one call.
+        bytes_per_call: a sequence of input sizes, one per input.
+    Returns:
+        A dict of throughput and latency figures.
+    '''
+    latencies = []
+    clock = time.perf_counter
+    for item in inputs:
+        start = clock()
+        call(item)
+        latencies.append(clock() - start)
+    total = sum(latencies) or 1e-12
+    latencies.sort()
+    return {
+        'path': name,
+        'calls': len(inputs),
+        'messages_per_sec': len(inputs) * items_per_call / total,
+        'bytes_per_sec': sum(bytes_per_call) / total,
+        'p50_us': percentile(latencies, 0.50) * 1e6,
+        'p90_us': percentile(latencies, 0.90) * 1e6,
+        'p99_us': percentile(latencies, 0.99) * 1e6,
+        'max_us': latencies[-1] * 1e6 if latencies else 0.0,
+    }
+
+
+def run(messages: int = 20000, fields: int = 5, length: int = 120,
+        pii_density: float = 0.5, rows: int = 20000,
+        repeat: int = 5, seed: int = 0) -> Dict:
+    '''
+    Runs every redaction path benchmark.
+    Returns:
+        A dict with the parameters and one result per path.
+    '''
+    corpus = make_messages(messages, fields, length, pii_density, seed)
+    sizes = [len(message) for message in corpus]
+    records = [logging.LogRecord('user_data', logging.INFO, __file__, 0,
+                                 message, None, None) for message in corpus]
+    structured_records = [
+        logging.LogRecord('user_data', logging.INFO, __file__, 0,
+                          "login %(email)s", ({'email': message},), None)
+        for message in corpus]
+
+    formatter = RedactingFormatter(PII_FIELDS)
+    structured = RedactingFormatter(PII_FIELDS, structured=True)
+    results = [
+        measure('filter_datum', lambda message: filter_datum(
+            PII_FIELDS, RedactingFormatter.REDACTION, message,
+            RedactingFormatter.SEPARATOR), corpus, bytes_per_call=sizes),
+        measure('RedactingFormatter', formatter.format, records,
+                bytes_per_call=sizes),
+        measure('RedactingFormatter.structured', structured.format,
+                structured_records, bytes_per_call=sizes),
+    ]
+
+    db_connector = make_users_db(rows, fields, pii_density, seed)
+    logger = logging.getLogger('benchmark.user_data')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler = logging.StreamHandler(io.StringIO())
+    handler.setFormatter(RedactingFormatter(PII_FIELDS))
+    logger.addHandler(handler)
+
+    def export(_):
+        handler.setStream(io.StringIO())
+        export_users(db_connector, logger)
+
+    export(None)
+    output_size = len(handler.stream.getvalue())
+    results.append(measure('export_users', export, range(repeat),
+                           items_per_call=rows,
+                           bytes_per_call=[output_size] * repeat))
+    logger.removeHandler(handler)
+    db_connector.close()
+    return {
+        'parameters': {
+            'messages': messages, 'fields': fields, 'length': length,
+            'pii_density': pii_density, 'rows': rows, 'repeat': repeat,
+            'seed': seed, 'python': sys.version.split()[0],
+        },
+        'results': results,
+    }
+
+
+def main() -> None:
+    '''
+    Parses the command line and prints the benchmark report.
+    Returns:
+        None
+    '''
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--fields', type=int, default=5)
+    parser.add_argument('--length', type=int, default=120)
+    parser.add_argument('--pii-density', type=float, default=0.5)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true',
+                        help="print a machine-readable JSON report")
+    args = parser.parse_args()
+
+    report = run(args.messages, args.fields, args.length, args.pii_density,
+                 args.rows, args.repeat, args.seed)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print("{:<32}{:>14}{:>14}{:>10}{:>10}{:>10}".format(
+        'path', 'msg/s', 'bytes/s', 'p50 us', 'p90 us', 'p99 us'))
+    for result in report['results']:
+        print("{path:<32}{messages_per_sec:>14,.0f}{bytes_per_sec:>14,.0f}"
+              "{p50_us:>10.1f}{p90_us:>10.1f}{p99_us:>10.1f}".format(
+                  **result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+'''
+This module contains the following:
+- ConnectionPool
+- PooledConnection
+'''
+
+from collections import deque
+from contextlib import contextmanager
+import os
+import threading
+import time
+from typing import Callable, Iterator, Optional
+
+
+def ping(connection) -> bool:
+    '''
+    Returns a boolean value.
+    Args:
+        connection: a DB-API connection.
+    Returns:
+        True if the connection still answers, False otherwise.
+    '''
+    try:
+        if hasattr(connection, "is_connected"):
+            return connection.is_connected()
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+        finally:
+            cursor.close()
+        return True
+    except Exception:
+        return False
+
+
+class PooledConnection:
+    '''
+    Wraps a borrowed connection; close() hands it back to its pool.
+    Every other attribute is delegated to the underlying connection.
+    Attributes:
+        pool: a ConnectionPool object.
+        raw: the underlying DB-API connection.
+    Methods:
+        close: returns None.
+    '''
+
+    def __init__(self, pool: 'ConnectionPool', raw):
+        '''
+        initialization
+        '''
+        self.pool = pool
+        self.raw = raw
+
+    def __getattr__(self, name: str):
+        '''
+        Delegates to the underlying connection.
+        '''
+        if self.raw is None:
+            raise AttributeError("connection was returned to the pool")
+        return getattr(self.raw, name)
+
+    def __enter__(self) -> 'PooledConnection':
+        '''
+        Returns the connection itself.
+        '''
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        '''
+        Returns the connection to the pool.
+        '''
+        self.close()
+
+    def close(self) -> None:
+        '''
+        Returns the connection to the pool; calling it twice is harmless.
+        Returns:
+            None
+        '''
+        raw, self.raw = self.raw, None
+        if raw is not None:
+            self.pool.release(raw)
+
+
+class ConnectionPool:
+    '''
+    A thread-safe pool of DB-API connections.
+    Attributes:
+        connect: a callable returning a new connection (the driver).
+        size: an integer, the number of connections kept idle.
+        max_overflow: an integer, extra connections opened under load
+            and closed once returned.
+        idle_timeout: a float, seconds after which an idle connection
+            is closed instead of reused (0 disables).
+        timeout: a float, seconds acquire() waits for a free slot.
+        health_check: a callable run on borrow; False discards the
+            connection.
+        pid: an integer, the id of the process that created the pool.
+    Methods:
+        acquire: returns a PooledConnection object.
+        release: returns None.
+        connection: a context manager yielding a PooledConnection.
+        close: returns None.
+    '''
+
+    def __init__(self, connect: Callable, size: int = 5,
+                 max_overflow: int = 10, idle_timeout: float = 300.0,
+                 timeout: float = 30.0,
+                 health_check: Optional[Callable] = ping):
+        '''
+        initialization
+        '''
+        self.connect = connect
+        self.size = size
+        self.max_overflow = max_overflow
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.health_check = health_check
+        self.pid = os.getpid()
+        self._idle = deque()
+        self._opened = 0
+        self._closed = False
+        self._lock = threading.Condition()
+
+    def _discard(self, raw) -> None:
+        '''
+        Closes a connection and frees its slot.
+        '''
+        try:
+            raw.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._opened -= 1
+            self._lock.notify()
+
+    def _expired(self) -> list:
+        '''
+        Pops idle connections older than idle_timeout. Lock must be held.
+        '''
+        if not self.idle_timeout:
+            return []
+        expired = []
+        deadline = time.monotonic() - self.idle_timeout
+        # The oldest connections sit at the left of the deque
+        while self._idle and self._idle[0][1] < deadline:
+            expired.append(self._idle.popleft()[0])
+        return expired
+
+    def acquire(self) -> PooledConnection:
+        '''
+        Borrows a healthy connection, opening one if a slot is free.
+        Returns:
+            A PooledConnection object.
+        '''
+        deadline = time.monotonic() + self.timeout
+        while True:
+            raw = None
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("connection pool is closed")
+                expired = self._expired()
+                while not self._idle and \
+                        self._opened - len(expired) >= \
+                        self.size + self.max_overflow:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(
+                            "no connection available after {}s".format(
+                                self.timeout))
+                    self._lock.wait(remaining)
+                if self._idle:
+                    raw = self._idle.pop()[0]
+                else:
+                    self._opened += 1
+            for conn in expired:
+                self._discard(conn)
+
+            if raw is None:
+                try:
+                    raw = self.connect()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                        self._lock.notify()
+                    raise
+                return PooledConnection(self, raw)
+            if self.health_check is None or self.health_check(raw):
+                return PooledConnection(self, raw)
+            self._discard(raw)
+
+    def release(self, raw) -> None:
+        '''
+        Takes a connection back, rolling back any open transaction.
+        Args:
+            raw: the underlying DB-API connection.
+        Returns:
+            None
+        '''
+        try:
+            raw.rollback()
+        except Exception:
+            self._discard(raw)
+            return
+        with self._lock:
+            if not self._closed and len(self._idle) < self.size:
+                self._idle.append((raw, time.monotonic()))
+                self._lock.notify()
+                return
+        self._discard(raw)
+
+    @contextmanager
+    def connection(self) -> Iterator[PooledConnection]:
+        '''
+        Yields a borrowed connection and returns it to the pool on exit.
+        '''
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def close(self) -> None:
+        '''
+        Closes every idle connection; borrowed ones close on release.
+        Returns:
+            None
+        '''
+        with self._lock:
+            self._closed = True
+            idle = [raw for raw, _ in self._idle]
+            self._idle.clear()
+        for raw in idle:
+            self._discard(raw)
@@ -4,10 +4,109 @@
 This module contains the following:
 - hash_password
 - is_valid
+- hash_passwords
+- verify_many
+- hash_password_async
+- is_valid_async
+- hash_passwords_async
+- verify_many_async
+- calibrate_rounds
+- save_rounds
+- get_rounds
+- verify_and_maybe_rehash
 '''
 
+import asyncio
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+import json
+import os
+import time
+from typing import (AsyncIterator, Callable, Iterable, Iterator, Optional,
+                    Tuple)
+
 import bcrypt
 
+# bcrypt releases the GIL while hashing, so threads scale across cores
+DEFAULT_WORKERS = os.cpu_count() or 1
+# bcrypt.gensalt() default, used until a deployment is calibrated
+DEFAULT_ROUNDS = 12
+MIN_ROUNDS = 4
+MAX_ROUNDS = 31
+ROUNDS_CONFIG = os.getenv("PERSONAL_DATA_BCRYPT_CONFIG", ".bcrypt.json")
+
+
+def get_rounds() -> int:
+    '''
+    Returns the target bcrypt work factor: PERSONAL_DATA_BCRYPT_ROUNDS
+    when set, else the calibrated value in ROUNDS_CONFIG, else
+    DEFAULT_ROUNDS.
+    Returns:
+        An integer.
+    '''
+    rounds = os.getenv("PERSONAL_DATA_BCRYPT_ROUNDS")
+    if rounds:
+        return int(rounds)
+    try:
+        with open(ROUNDS_CONFIG) as f:
+            return int(json.load(f)["rounds"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return DEFAULT_ROUNDS
+
+
+def save_rounds(rounds: int, path: str = ROUNDS_CONFIG) -> None:
+    '''
+    Stores a work factor in the config file read by get_rounds.
+    Args:
+        rounds: an integer.
+        path: a string, the config file.
+    Returns:
+        None
+    '''
+    with open(path, 'w') as f:
+        json.dump({"rounds": rounds}, f)
+
+
+def calibrate_rounds(target_seconds: float = 0.25,
+                     min_rounds: int = MIN_ROUNDS,
+                     max_rounds: int = MAX_ROUNDS) -> int:
+    '''
+    Picks the work factor whose hash time on this machine is closest to
+    the target. Each extra round doubles the cost, so rounds are raised
+    until the next one would overshoot.
+    Args:
+        target_seconds: a float, the wanted verification latency.
+        min_rounds: an integer.
+        max_rounds: an integer.
+    Returns:
+        An integer.
+    '''
+    password = b"calibration"
+    rounds = min_rounds
+    while True:
+        start = time.perf_counter()
+        bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+        elapsed = time.perf_counter() - start
+        if rounds >= max_rounds or elapsed * 2 > target_seconds:
+            break
+        rounds += 1
+    # Keep one round more when its doubled cost is closer to the target
+    if rounds < max_rounds and \
+            elapsed * 2 - target_seconds < target_seconds - elapsed:
+        rounds += 1
+    return rounds
+
+
+def hash_rounds(hashed_password: bytes) -> int:
+    '''
+    Returns the work factor stored in a bcrypt hash ($2b$<rounds>$...).
+    Args:
+        hashed_password: a byte string argument.
+    Returns:
+        An integer.
+    '''
+    return int(hashed_password.split(b"$")[2])
+
 
 def hash_password(password: str) -> bytes:
     '''
@@ -17,7 +116,8 @@ def hash_password(password: str) -> bytes:
     Returns:
         A byte string.
     '''
-    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+    return bcrypt.hashpw(password.encode("utf-8"),
+                         bcrypt.gensalt(get_rounds()))
 
 
 def is_valid(hashed_password: bytes, password: str) -> bool:
@@ -30,3 +130,161 @@ def is_valid(hashed_password: bytes, password: str) -> bool:
         A boolean value.
     '''
     return bcrypt.checkpw(password.encode("utf-8"), hashed_password)
+
+
+def verify_and_maybe_rehash(hashed_password: bytes, password: str
+                            ) -> Tuple[bool, Optional[bytes]]:
+    '''
+    Checks a password and upgrades its hash to the target work factor.
+    Args:
+        hashed_password: a byte string argument.
+        password: a string argument.
+    Returns:
+        A (valid, new_hash) tuple; new_hash is None unless the password
+        is valid and the stored cost differs from get_rounds().
+    '''
+    if not is_valid(hashed_password, password):
+        return False, None
+    if hash_rounds(hashed_password) == get_rounds():
+        return True, None
+    return True, hash_password(password)
+
+
+def _verify_pair(pair: Tuple[bytes, str]) -> bool:
+    '''
+    Returns is_valid for a (hashed_password, password) tuple.
+    '''
+    return is_valid(*pair)
+
+
+def _imap(func: Callable, iterable: Iterable,
+          max_workers: Optional[int] = None) -> Iterator:
+    '''
+    Yields func(item) for every item, in order, from a thread pool.
+    At most two tasks per worker are in flight, so large or endless
+    iterables are consumed lazily.
+    Args:
+        func: a callable taking one item.
+        iterable: the items.
+        max_workers: an integer, the pool size.
+    Returns:
+        An iterator of results.
+    '''
+    max_workers = max_workers or DEFAULT_WORKERS
+    executor = ThreadPoolExecutor(max_workers)
+    pending = deque()
+    try:
+        for item in iterable:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= max_workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def hash_passwords(passwords: Iterable[str],
+                   max_workers: Optional[int] = None) -> Iterator[bytes]:
+    '''
+    Hashes many passwords on a bounded thread pool.
+    Args:
+        passwords: an iterable of strings.
+        max_workers: an integer, the number of threads.
+    Returns:
+        An iterator of byte strings, in input order.
+    '''
+    return _imap(hash_password, passwords, max_workers)
+
+
+def verify_many(pairs: Iterable[Tuple[bytes, str]],
+                max_workers: Optional[int] = None) -> Iterator[bool]:
+    '''
+    Checks many passwords on a bounded thread pool.
+    Args:
+        pairs: an iterable of (hashed_password, password) tuples.
+        max_workers: an integer, the number of threads.
+    Returns:
+        An iterator of boolean values, in input order.
+    '''
+    return _imap(_verify_pair, pairs, max_workers)
+
+
+async def hash_password_async(password: str,
+                              executor: Optional[Executor] = None) -> bytes:
+    '''
+    Returns a salted, hashed password without blocking the event loop.
+    Args:
+        password: a string argument.
+        executor: an Executor, the loop's default one when None.
+    Returns:
+        A byte string.
+    '''
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, hash_password, password)
+
+
+async def is_valid_async(hashed_password: bytes, password: str,
+                         executor: Optional[Executor] = None) -> bool:
+    '''
+    Returns is_valid without blocking the event loop.
+    Args:
+        hashed_password: a byte string argument.
+        password: a string argument.
+        executor: an Executor, the loop's default one when None.
+    Returns:
+        A boolean value.
+    '''
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, is_valid, hashed_password, password)
+
+
+async def _aimap(func: Callable, iterable: Iterable,
+                 max_workers: Optional[int] = None) -> AsyncIterator:
+    '''
+    Async counterpart of _imap: yields func(item) in order while the
+    work runs on a bounded thread pool.
+    '''
+    max_workers = max_workers or DEFAULT_WORKERS
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers)
+    pending = deque()
+    try:
+        for item in iterable:
+            pending.append(loop.run_in_executor(executor, func, item))
+            if len(pending) >= max_workers * 2:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def hash_passwords_async(passwords: Iterable[str],
+                         max_workers: Optional[int] = None
+                         ) -> AsyncIterator[bytes]:
+    '''
+    Hashes many passwords without blocking the event loop.
+    Args:
+        passwords: an iterable of strings.
+        max_workers: an integer, the number of threads.
+    Returns:
+        An async iterator of byte strings, in input order.
+    '''
+    return _aimap(hash_password, passwords, max_workers)
+
+
+def verify_many_async(pairs: Iterable[Tuple[bytes, str]],
+                      max_workers: Optional[int] = None
+                      ) -> AsyncIterator[bool]:
+    '''
+    Checks many passwords without blocking the event loop.
+    Args:
+        pairs: an iterable of (hashed_password, password) tuples.
+        max_workers: an integer, the number of threads.
+    Returns:
+        An async iterator of boolean values, in input order.
+    '''
+    return _aimap(_verify_pair, pairs, max_workers)
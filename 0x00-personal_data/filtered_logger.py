@@ -4,13 +4,25 @@
 This module is a secure log filter
 '''
 
+from contextlib import contextmanager
+from db_pool import ConnectionPool
+from functools import lru_cache
+import json
 import logging
+from logging.handlers import QueueHandler, QueueListener
 from mysql.connector.connection import MySQLConnection
 import os
+import queue
 import re
-from typing import List
+from typing import Iterator, List, Mapping, Sequence, Tuple
 
 PII_FIELDS = ('name', 'email', 'phone', 'password', 'ssn')
+OVERFLOW_POLICIES = ('block', 'drop', 'drop-oldest')
+DEFAULT_BATCH_SIZE = 1000
+_pool = None
+# Attributes every LogRecord carries; anything else came from `extra`
+RECORD_ATTRIBUTES = frozenset(
+    logging.makeLogRecord({}).__dict__) | {'message', 'asctime'}
 
 
 def filter_datum(
@@ -29,31 +41,137 @@ def filter_datum(
     Returns:
         A string.
     '''
-    logtext = message
-    for field in fields:
-        logtext = re.sub(field + "=.*?" + separator,
-                         field + "=" + redaction + separator, logtext)
-    return logtext
+    return get_redaction_engine(
+        tuple(fields), redaction, separator).redact(message)
 
 
-def get_logger() -> logging.Logger:
+class RedactionEngine:
+    '''
+    Rewrites every field of a log message in a single scan.
+    Messages containing none of the "field=" keys are returned untouched
+    after a literal prefilter, which is much cheaper than the regex.
+    Attributes:
+        fields: a tuple of strings.
+        redaction: a string.
+        separator: a string.
+        hits: an integer, messages that went through substitution.
+        misses: an integer, messages rejected by the prefilter.
+    Methods:
+        redact: returns a string.
+        stats: returns a dict.
+    '''
+
+    def __init__(self, fields: Tuple[str, ...], redaction: str,
+                 separator: str):
+        '''
+        initialization
+        '''
+        self.fields = fields
+        self.redaction = redaction
+        self.separator = separator
+        self.hits = 0
+        self.misses = 0
+        self._keys = tuple(field + "=" for field in fields)
+        self._pattern = None
+        if fields:
+            self._pattern = re.compile(
+                "(" + "|".join(fields) + ")=.*?" + separator)
+        self._replacement = r"\g<1>=" + redaction + separator
+
+    def redact(self, message: str) -> str:
+        '''
+        Returns a string.
+        Args:
+            message: a string argument.
+        Returns:
+            A string.
+        '''
+        for key in self._keys:
+            if key in message:
+                break
+        else:
+            self.misses += 1
+            return message
+
+        self.hits += 1
+        # Substitution only has to start at the first key found
+        start = min(position for position in map(message.find, self._keys)
+                    if position >= 0)
+        if start == 0:
+            return self._pattern.sub(self._replacement, message)
+        return message[:start] + self._pattern.sub(
+            self._replacement, message[start:])
+
+    def stats(self) -> dict:
+        '''
+        Returns a dict.
+        Returns:
+            The prefilter hits, misses and hit_ratio. Counters are
+            updated without a lock, so they are approximate under
+            concurrent use.
+        '''
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
+
+
+@lru_cache(maxsize=128)
+def get_redaction_engine(
+        fields: Tuple[str, ...],
+        redaction: str,
+        separator: str,
+) -> RedactionEngine:
+    '''
+    Returns a cached RedactionEngine object.
+    Args:
+        fields: a tuple of strings.
+        redaction: a string argument.
+        separator: a string argument.
+    Returns:
+        A RedactionEngine object.
+    '''
+    return RedactionEngine(fields, redaction, separator)
+
+
+def get_logger(
+        non_blocking: bool = False,
+        queue_size: int = 10000,
+        overflow: str = 'block',
+) -> logging.Logger:
     '''
     Returns a logging.Logger object.
+    Args:
+        non_blocking: when True, redaction and I/O run on a background
+            listener thread fed by a bounded queue.
+        queue_size: an integer, the maximum number of pending records.
+        overflow: a string, one of OVERFLOW_POLICIES.
     Returns:
-        A logging.Logger object.
+        A logging.Logger object, whose handlers from earlier calls are
+        replaced (and closed) so each record is written once.
     '''
     logger = logging.getLogger('user_data')
     logger.setLevel(logging.INFO)
     logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
     stream_handler = logging.StreamHandler()
     stream_handler.setFormatter(RedactingFormatter(PII_FIELDS))
-    logger.addHandler(stream_handler)
+    if not non_blocking:
+        logger.addHandler(stream_handler)
+        return logger
+
+    logger.addHandler(NonBlockingHandler(stream_handler, queue_size,
+                                         overflow))
     return logger
 
 
-def get_db() -> MySQLConnection:
+def connect_db() -> MySQLConnection:
     '''
-    Returns a MySQLConnection object.
+    Opens a new MySQLConnection object.
     Returns:
         A MySQLConnection object.
     '''
@@ -66,27 +184,132 @@ def get_db() -> MySQLConnection:
     )
 
 
+def get_pool() -> ConnectionPool:
+    '''
+    Returns the process-wide ConnectionPool object, configured from
+    PERSONAL_DATA_DB_POOL_SIZE, PERSONAL_DATA_DB_POOL_OVERFLOW and
+    PERSONAL_DATA_DB_POOL_IDLE_TIMEOUT.
+    Returns:
+        A ConnectionPool object.
+    '''
+    global _pool
+    # A forked child must not share its parent's sockets
+    if _pool is None or _pool.pid != os.getpid():
+        _pool = ConnectionPool(
+            connect_db,
+            size=int(os.getenv("PERSONAL_DATA_DB_POOL_SIZE", 5)),
+            max_overflow=int(os.getenv(
+                "PERSONAL_DATA_DB_POOL_OVERFLOW", 10)),
+            idle_timeout=float(os.getenv(
+                "PERSONAL_DATA_DB_POOL_IDLE_TIMEOUT", 300)))
+    return _pool
+
+
+def get_db() -> MySQLConnection:
+    '''
+    Returns a MySQLConnection object.
+    When PERSONAL_DATA_DB_POOL_SIZE is set, the connection is borrowed
+    from get_pool() and close() returns it to the pool.
+    Returns:
+        A MySQLConnection object.
+    '''
+    if int(os.getenv("PERSONAL_DATA_DB_POOL_SIZE", 0)) > 0:
+        return get_pool().acquire()
+    return connect_db()
+
+
+@contextmanager
+def db_connection():
+    '''
+    Yields a connection from get_db() and closes it (returning pooled
+    connections to the pool) on exit.
+    '''
+    db_connector = get_db()
+    try:
+        yield db_connector
+    finally:
+        db_connector.close()
+
+
 class RedactingFormatter(logging.Formatter):
     '''
     This class inherits from logging.Formatter.
+    In structured mode, PII is redacted on the LogRecord itself (mapping
+    args and `extra` attributes named after a field) before formatting,
+    so the rendered line is not rescanned. Values interpolated into the
+    message text from other places are then left as they are.
     Attributes:
         REDACTION: a string.
         FORMAT: a string.
         SEPARATOR: a string.
         fields: a list of strings.
+        engine: a RedactionEngine object.
+        structured: a boolean.
+        json_output: a boolean, render structured records as JSON.
     Methods:
         format: returns a string.
+        redact_record: returns a logging.LogRecord object.
+        to_json: returns a string.
     '''
     REDACTION = "***"
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
 
-    def __init__(self, fields: List[str]):
+    def __init__(self, fields: List[str], structured: bool = False,
+                 json_output: bool = False):
         '''
         initialization
         '''
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self.engine = get_redaction_engine(
+            tuple(fields), self.REDACTION, self.SEPARATOR)
+        self.structured = structured or json_output
+        self.json_output = json_output
+        self._extra_fields = [field for field in fields
+                              if field not in RECORD_ATTRIBUTES]
+
+    def redact_record(self, record: logging.LogRecord) -> logging.LogRecord:
+        '''
+        Returns a copy of the record with its PII args and extras redacted.
+        Args:
+            record: a logging.LogRecord object.
+        Returns:
+            A logging.LogRecord object.
+        '''
+        record = logging.makeLogRecord(record.__dict__)
+        if isinstance(record.args, Mapping):
+            args = dict(record.args)
+            for field in self.fields:
+                if field in args:
+                    args[field] = self.REDACTION
+            record.args = args
+        attributes = record.__dict__
+        for field in self._extra_fields:
+            if field in attributes:
+                attributes[field] = self.REDACTION
+        return record
+
+    def to_json(self, record: logging.LogRecord) -> str:
+        '''
+        Returns a JSON string.
+        Args:
+            record: a logging.LogRecord object, already redacted.
+        Returns:
+            A string.
+        '''
+        document = {
+            'name': record.name,
+            'levelname': record.levelname,
+            'asctime': self.formatTime(record, self.datefmt),
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES:
+                document[key] = value
+        if record.exc_info:
+            document['exc_text'] = self.formatException(record.exc_info)
+        return json.dumps(document, default=str)
 
     def format(self, record: logging.LogRecord) -> str:
         '''
@@ -96,33 +319,191 @@ class RedactingFormatter(logging.Formatter):
         Returns:
             A string.
         '''
-        return filter_datum(
-            self.fields, self.REDACTION, super(
-                RedactingFormatter, self).format(record), self.SEPARATOR)
+        if not self.structured:
+            return self.engine.redact(
+                super(RedactingFormatter, self).format(record))
+        record = self.redact_record(record)
+        if self.json_output:
+            return self.to_json(record)
+        return super(RedactingFormatter, self).format(record)
 
 
-def main() -> None:
+class _FlushingQueueListener(QueueListener):
     '''
-    This function logs rows from the users table.
+    A QueueListener whose stop sentinel is never dropped on a full queue.
+    '''
+
+    def enqueue_sentinel(self) -> None:
+        '''
+        Blocks until the stop sentinel fits behind the pending records.
+        '''
+        self.queue.put(self._sentinel)
+
+
+class NonBlockingHandler(QueueHandler):
+    '''
+    This class inherits from logging.handlers.QueueHandler.
+    Records are queued as-is; a listener thread formats, redacts and
+    writes them through the wrapped handler.
+    Attributes:
+        overflow: a string, one of OVERFLOW_POLICIES.
+        dropped: an integer, the number of records lost to overflow.
+        listener: a QueueListener object.
+    Methods:
+        prepare: returns a logging.LogRecord object.
+        enqueue: returns None.
+        close: returns None.
+    '''
+
+    def __init__(self, handler: logging.Handler, queue_size: int = 10000,
+                 overflow: str = 'block'):
+        '''
+        initialization
+        '''
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("overflow must be one of {}".format(
+                ", ".join(OVERFLOW_POLICIES)))
+        super(NonBlockingHandler, self).__init__(queue.Queue(queue_size))
+        self.overflow = overflow
+        self.dropped = 0
+        self.listener = _FlushingQueueListener(
+            self.queue, handler, respect_handler_level=True)
+        self.listener.start()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        '''
+        Returns the record untouched so formatting stays off this thread.
+        Args:
+            record: a logging.LogRecord object.
+        Returns:
+            A logging.LogRecord object.
+        '''
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        '''
+        Queues a record according to the overflow policy.
+        Args:
+            record: a logging.LogRecord object.
+        Returns:
+            None
+        '''
+        if self.overflow == 'block':
+            self.queue.put(record)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                self.dropped += 1
+                if self.overflow == 'drop':
+                    return
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+            except queue.Empty:
+                pass
+
+    def close(self) -> None:
+        '''
+        Flushes pending records and stops the listener thread.
+        Returns:
+            None
+        '''
+        self.acquire()
+        try:
+            listener, self.listener = self.listener, None
+        finally:
+            self.release()
+        if listener is not None:
+            listener.stop()
+        super(NonBlockingHandler, self).close()
+
+
+def iter_rows(cursor, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator:
+    '''
+    Yields rows from an executed cursor, fetching them in batches.
+    Args:
+        cursor: a DB-API cursor with a pending result set.
+        batch_size: an integer, the number of rows per fetchmany call.
     Returns:
-        None
+        An iterator of rows.
     '''
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
 
-    db_connector = get_db()
+
+def row_template(columns: Sequence[str]) -> str:
+    '''
+    Returns a format string that renders a row as "column=value; " pairs.
+    Args:
+        columns: a sequence of column names.
+    Returns:
+        A string.
+    '''
+    return "".join(column.replace("{", "{{").replace("}", "}}") + "={}; "
+                   for column in columns)
+
+
+def iter_messages(cursor,
+                  batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[str]:
+    '''
+    Yields a "column=value; " message for every executed row carrying PII.
+    Args:
+        cursor: a DB-API cursor with a pending result set.
+        batch_size: an integer, the number of rows per fetchmany call.
+    Returns:
+        An iterator of strings.
+    '''
+    columns = [description[0] for description in cursor.description]
+    pii_indexes = [i for i, column in enumerate(columns)
+                   if column in PII_FIELDS]
+    template = row_template(columns)
+    for row in iter_rows(cursor, batch_size):
+        # Only rows carrying a PII column value are logged
+        if any(row[i] is not None for i in pii_indexes):
+            yield template.format(*row)
+
+
+def export_users(
+        db_connector,
+        logger: logging.Logger,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+) -> int:
+    '''
+    Streams the users table through the logger.
+    Args:
+        db_connector: a DB-API connection.
+        logger: a logging.Logger object.
+        batch_size: an integer, the number of rows per fetchmany call.
+    Returns:
+        The number of rows logged.
+    '''
     csr = db_connector.cursor()
     csr.execute("SELECT * FROM users;")
-    logger = get_logger()
-
-    for row in csr:
-        # Check if any of the row values are in PII_FIELDS
-        if any(field in str(row) for field in PII_FIELDS):
-            message = ""
-            for i in range(len(row)):
-                message += f"{csr.column_names[i]}={str(row[i])}; "
+    count = 0
+    try:
+        for message in iter_messages(csr, batch_size):
             logger.info(message)
+            count += 1
+    finally:
+        csr.close()
+    return count
+
 
-    csr.close()
-    db_connector.close()
+def main() -> None:
+    '''
+    This function logs rows from the users table.
+    Returns:
+        None
+    '''
+    with db_connection() as db_connector:
+        export_users(db_connector, get_logger(), int(os.getenv(
+            "PERSONAL_DATA_BATCH_SIZE", DEFAULT_BATCH_SIZE)))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+'''
+This module dumps a redacted copy of the users table in parallel:
+- key_ranges
+- dump_partition
+- parallel_dump
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+from typing import Callable, List, Optional, TextIO, Tuple
+
+from filtered_logger import (DEFAULT_BATCH_SIZE, PII_FIELDS,
+                             RedactingFormatter, get_db, iter_messages)
+
+IDENTIFIER = re.compile(r"^\w+$")
+
+
+def _identifier(name: str) -> str:
+    '''
+    Returns a string.
+    Args:
+        name: a table or column name.
+    Returns:
+        The name, once checked to be safe to interpolate into SQL.
+    '''
+    if not IDENTIFIER.match(name):
+        raise ValueError("invalid SQL identifier: {!r}".format(name))
+    return name
+
+
+def key_ranges(
+        db_connector,
+        partitions: int,
+        table: str = 'users',
+        key: str = 'id',
+) -> List[Tuple[int, int]]:
+    '''
+    Splits the integer primary key span of a table into ranges.
+    Args:
+        db_connector: a DB-API connection.
+        partitions: an integer, the number of ranges wanted.
+        table: a string, the table name.
+        key: a string, the integer primary key column.
+    Returns:
+        A list of [start, stop) tuples covering every key, in order.
+    '''
+    csr = db_connector.cursor()
+    try:
+        csr.execute("SELECT MIN({0}), MAX({0}) FROM {1};".format(
+            _identifier(key), _identifier(table)))
+        low, high = csr.fetchone()
+    finally:
+        csr.close()
+    if low is None:
+        return []
+
+    low, high = int(low), int(high) + 1
+    step = max(1, -(-(high - low) // max(1, partitions)))
+    return [(start, min(start + step, high))
+            for start in range(low, high, step)]
+
+
+def dump_partition(
+        connect: Callable,
+        key_range: Tuple[int, int],
+        out_path: str,
+        table: str = 'users',
+        key: str = 'id',
+        batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Tuple[str, int]:
+    '''
+    Formats and redacts the rows of one key range into a file.
+    Runs in a worker process, so it opens its own connection; lines are
+    written as the cursor yields them, never held all at once.
+    Args:
+        connect: a picklable callable returning a DB-API connection.
+        key_range: a [start, stop) tuple.
+        out_path: a string, the file the lines are written to.
+        table: a string, the table name.
+        key: a string, the integer primary key column.
+        batch_size: an integer, the number of rows per fetchmany call.
+    Returns:
+        An (out_path, number of lines written) tuple.
+    '''
+    formatter = RedactingFormatter(PII_FIELDS)
+    count = 0
+    db_connector = connect()
+    try:
+        csr = db_connector.cursor()
+        try:
+            csr.execute(
+                "SELECT * FROM {1} WHERE {0} >= {2:d} AND {0} < {3:d} "
+                "ORDER BY {0};".format(_identifier(key), _identifier(table),
+                                       *key_range))
+            with open(out_path, 'w') as f:
+                for message in iter_messages(csr, batch_size):
+                    f.write(formatter.format(logging.LogRecord(
+                        'user_data', logging.INFO, __file__, 0, message,
+                        None, None)) + "\n")
+                    count += 1
+        finally:
+            csr.close()
+    finally:
+        db_connector.close()
+    return out_path, count
+
+
+def parallel_dump(
+        connect: Callable = get_db,
+        workers: Optional[int] = None,
+        partitions: Optional[int] = None,
+        table: str = 'users',
+        key: str = 'id',
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        out_dir: Optional[str] = None,
+        stream: Optional[TextIO] = None,
+) -> int:
+    '''
+    Dumps a redacted copy of a table using a pool of worker processes.
+    Args:
+        connect: a picklable callable returning a DB-API connection,
+            e.g. functools.partial(sqlite3.connect, path) in tests.
+        workers: an integer, the number of processes (default: CPUs).
+        partitions: an integer, the number of key ranges
+            (default: four per worker).
+        table: a string, the table name.
+        key: a string, the integer primary key column.
+        batch_size: an integer, the number of rows per fetchmany call.
+        out_dir: when set, each partition is written to its own
+            users.<n>.log file in this directory.
+        stream: where merged lines go when out_dir is not set
+            (default: sys.stderr, like logging.StreamHandler); the
+            partitions are then written to temporary files and copied
+            in key order, so no process holds a whole partition.
+    Returns:
+        The number of lines written.
+    '''
+    workers = workers or os.cpu_count() or 1
+    db_connector = connect()
+    try:
+        ranges = key_ranges(db_connector, partitions or workers * 4,
+                            table, key)
+    finally:
+        db_connector.close()
+
+    if stream is None:
+        stream = sys.stderr
+    merge = out_dir is None
+    tmp_dir = tempfile.mkdtemp(prefix="{}.".format(table)) if merge \
+        else None
+    out_paths = [os.path.join(tmp_dir if merge else out_dir,
+                              "{}.{}.log".format(table, i))
+                 for i in range(len(ranges))]
+
+    count = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                dump_partition, [connect] * len(ranges), ranges, out_paths,
+                [table] * len(ranges), [key] * len(ranges),
+                [batch_size] * len(ranges))
+            # map() yields in submission order, so output stays key-ordered
+            for out_path, lines in results:
+                count += lines
+                if merge:
+                    with open(out_path) as f:
+                        shutil.copyfileobj(f, stream)
+                    os.remove(out_path)
+    finally:
+        if merge:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return count
+
+
+if __name__ == "__main__":
+    parallel_dump(workers=int(os.getenv("PERSONAL_DATA_DUMP_WORKERS", 0))
+                  or None)
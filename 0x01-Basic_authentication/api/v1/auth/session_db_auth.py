@@ -25,7 +25,6 @@ class SessionDBAuth(SessionExpAuth):
         kwargs = {"user_id": user_id, "session_id": session_id}
         userSesh = UserSession(**kwargs)
         userSesh.save()
-        userSesh.save_to_file()
         return session_id
 
     def user_id_for_session_id(self, session_id=None):
@@ -36,7 +35,7 @@ class SessionDBAuth(SessionExpAuth):
             return None
 
         UserSession.load_from_file()
-        userSesh = UserSession.search({'session_id': session_id})
+        userSesh = UserSession.search({'session_id': session_id}, limit=1)
 
         if not userSesh:
             return None
@@ -64,9 +63,8 @@ class SessionDBAuth(SessionExpAuth):
         user_id = self.user_id_for_session_id(session_id)
         if not user_id:
             return False
-        user_session = UserSession.search({"session_id": session_id})
+        user_session = UserSession.search({"session_id": session_id}, limit=1)
         if user_session:
             user_session[0].remove()
-            UserSession.save_to_file()
             return True
         return False
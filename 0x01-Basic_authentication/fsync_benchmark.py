@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+""" fsync policy benchmark
+
+Times single-user saves under each MODEL_FSYNC policy, with the snapshot
+rewritten on every save and with MODEL_JOURNAL appends, and the
+save_to_file() of the whole store. Prints the mean and 99th percentile
+latency of each.
+
+Run it in a scratch directory on the disk to measure, it writes
+`.db_User.*` files there.
+
+Usage: ./fsync_benchmark.py [users] [saves]   (default: 1000 200)
+"""
+import glob
+import os
+import sys
+import time
+from models.base import DATA
+from models.durability import FSYNC_POLICIES
+from models.user import User
+
+MODES = (
+    ("snapshot", {}),
+    ("journal", {"MODEL_JOURNAL": "1"}),
+)
+
+
+def make_user(i: int) -> User:
+    """ Return a user with a password (a SHA-256 hex digest once set)
+    """
+    user = User(email="user{}@example.com".format(i), first_name="First")
+    user.password = "password{}".format(i)
+    return user
+
+
+def clean():
+    """ Remove the store files of a previous run
+    """
+    for file_path in glob.glob(".db_User.*"):
+        os.remove(file_path)
+
+
+def latencies(saves: int) -> list:
+    """ Return the seconds each of `saves` single-user saves takes
+    """
+    times = []
+    for i in range(saves):
+        user = make_user(i)
+        start = time.perf_counter()
+        user.save()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(name: str, times: list):
+    """ Print the mean and 99th percentile of `times`
+    """
+    times = sorted(times)
+    p99 = times[min(len(times) - 1, int(len(times) * 0.99))]
+    print("{:<28} mean {:8.3f}ms  p99 {:8.3f}ms".format(
+        name, sum(times) / len(times) * 1000, p99 * 1000))
+
+
+def run(users: int, saves: int):
+    """ Print the save latencies of every policy and mode
+    """
+    for policy in FSYNC_POLICIES:
+        os.environ["MODEL_FSYNC"] = policy
+        for mode, env in MODES:
+            os.environ.pop("MODEL_JOURNAL", None)
+            os.environ.update(env)
+            clean()
+            DATA['User'] = {}
+            User.save_many([make_user(i) for i in range(users)])
+            report("{} {} save()".format(policy, mode), latencies(saves))
+            User.save_to_file()
+        start = time.perf_counter()
+        User.save_to_file()
+        report("{} save_to_file()".format(policy),
+               [time.perf_counter() - start])
+    os.environ.pop("MODEL_JOURNAL", None)
+    clean()
+    DATA['User'] = {}
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*(args + [1000, 200][len(args):]))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+""" Memory report for the model classes
+
+Compares the bytes per resident object of the slotted User and
+UserSession classes with equivalent __dict__-based objects (the layout
+models used before __slots__), and the cost of parsing timestamps with
+strptime versus models.base.parse_timestamp.
+
+Usage: ./memory_report.py [count]
+"""
+from datetime import datetime
+import sys
+import time
+import tracemalloc
+from models.base import TIMESTAMP_FORMAT, parse_timestamp
+from models.user import User
+from models.user_session import UserSession
+
+
+def measure(build, count: int) -> float:
+    """ Return the bytes allocated per object by `count` calls of build
+    """
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objs = [build(i) for i in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del objs
+    return size / count
+
+
+def dict_class(cls: type) -> type:
+    """ Return a plain __dict__-based class standing in for the old `cls`
+    One class per model, so instances share dict keys as they used to
+    """
+    return type(cls.__name__ + "Dict", (), {})
+
+
+def as_dict_object(obj, dict_cls: type):
+    """ Copy the attributes of a model into a `dict_cls` instance
+    """
+    copy = dict_cls()
+    for key in obj.fields():
+        setattr(copy, key, getattr(obj, key))
+    return copy
+
+
+def report(count: int = 100000):
+    """ Print the memory and timestamp parsing report
+    """
+    now = datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+    user_json = {'email': 'bob@hbtn.io', '_password': 'x' * 64,
+                 'first_name': 'Bob', 'last_name': 'Dylan',
+                 'created_at': now, 'updated_at': now}
+    session_json = {'user_id': 'u' * 36, 'created_at': now,
+                    'updated_at': now}
+
+    print("{:<14}{:>16}{:>16}{:>10}".format(
+        'class', '__dict__ B/obj', '__slots__ B/obj', 'saved'))
+    for cls, obj_json in ((User, user_json), (UserSession, session_json)):
+        dict_cls = dict_class(cls)
+        dict_size = measure(
+            lambda i: as_dict_object(cls(**obj_json), dict_cls), count)
+        slot_size = measure(lambda i: cls(**obj_json), count)
+        print("{:<14}{:>16.0f}{:>16.0f}{:>9.0%}".format(
+            cls.__name__, dict_size, slot_size, 1 - slot_size / dict_size))
+
+    start = time.perf_counter()
+    for _ in range(count):
+        datetime.strptime(now, TIMESTAMP_FORMAT)
+    strptime_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(count):
+        parse_timestamp(now)
+    codec_time = time.perf_counter() - start
+    print("\ntimestamp parse: strptime {:.2f} us, parse_timestamp {:.2f} us"
+          .format(strptime_time / count * 1e6, codec_time / count * 1e6))
+
+
+if __name__ == "__main__":
+    report(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
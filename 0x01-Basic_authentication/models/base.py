@@ -2,36 +2,50 @@
 """ Base module
 """
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
-import json
+from typing import TypeVar, List, Iterable, Iterator, Optional, Tuple
 import uuid
+from models.storage import DATA, get_storage
+from models.timestamps import TIMESTAMP_FORMAT, format_timestamp, \
+    parse_timestamp
 
 
-TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
-DATA = {}
+_UNSET = object()
 
 
 class Base():
     """ Base class
+
+    Persistence goes through the backend returned by get_storage().
+    Subclasses list the attributes backends should index for `search`
+    in `indexed_attributes` (equality) and `sorted_attributes` (Range
+    and Prefix predicates of models.query, and ordering).
+
+    Models declare their attributes in `__slots__`, so instances carry
+    no per-object __dict__; `fields()` lists them for to_json().
+
+    to_json() results are cached per object until an attribute is
+    assigned (save() assigns updated_at). Mutating a list or dict
+    attribute in place is not detected.
     """
+    __slots__ = ('id', 'created_at', 'updated_at', '_json_cache',
+                 '__weakref__')
+    indexed_attributes: Tuple[str, ...] = ()
+    sorted_attributes: Tuple[str, ...] = ('created_at', 'updated_at')
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
         s_class = str(self.__class__.__name__)
-        if DATA.get(s_class) is None:
-            DATA[s_class] = {}
+        # setdefault, so concurrent first instances share one dict
+        DATA.setdefault(s_class, {})
 
         self.id = kwargs.get('id', str(uuid.uuid4()))
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = parse_timestamp(kwargs.get('created_at'))
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = parse_timestamp(kwargs.get('updated_at'))
         else:
             self.updated_at = datetime.utcnow()
 
@@ -44,15 +58,73 @@ class Base():
             return False
         return (self.id == other.id)
 
+    @classmethod
+    def fields(cls) -> Tuple[str, ...]:
+        """ Return the declared attributes, base class first
+        """
+        fields = cls.__dict__.get('_fields')
+        if fields is None:
+            fields = []
+            for klass in reversed(cls.__mro__):
+                slots = klass.__dict__.get('__slots__', ())
+                if isinstance(slots, str):
+                    slots = (slots,)
+                for name in slots:
+                    if name not in ('__dict__', '__weakref__',
+                                    '_json_cache') and name not in fields:
+                        fields.append(name)
+            fields = tuple(fields)
+            cls._fields = fields
+        return fields
+
+    def __setattr__(self, name: str, value):
+        """ Set an attribute and drop the cached JSON dictionaries
+        """
+        object.__setattr__(self, name, value)
+        if name != '_json_cache':
+            object.__setattr__(self, '_json_cache', None)
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
         """
+        return self._cached_json(for_serialization)
+
+    def to_native(self) -> dict:
+        """ Like to_json(True), but datetime values stay datetime
+        (binary snapshots encode them natively)
+        """
+        return self._cached_json('native')
+
+    def _cached_json(self, key) -> dict:
+        """ Return a copy of the cached dictionary `key`, building it once
+        """
+        cache = getattr(self, '_json_cache', None)
+        if cache is None:
+            cache = {}
+            object.__setattr__(self, '_json_cache', cache)
+        result = cache.get(key)
+        if result is None:
+            result = cache[key] = self._build_json(key)
+        # Callers own the returned dictionary, the cache keeps its own
+        return dict(result)
+
+    def _build_json(self, kind) -> dict:
+        """ Build the dictionary of to_json(kind), or of to_native() when
+        kind is 'native'
+        """
+        native = kind == 'native'
+        for_serialization = bool(kind)
         result = {}
-        for key, value in self.__dict__.items():
+        items = [(key, getattr(self, key, _UNSET)) for key in self.fields()]
+        # Subclasses without __slots__ still keep extra attributes here
+        items.extend(getattr(self, '__dict__', {}).items())
+        for key, value in items:
+            if value is _UNSET:
+                continue
             if not for_serialization and key[0] == '_':
                 continue
-            if type(value) is datetime:
-                result[key] = value.strftime(TIMESTAMP_FORMAT)
+            if type(value) is datetime and not native:
+                result[key] = format_timestamp(value)
             else:
                 result[key] = value
         return result
@@ -61,52 +133,60 @@ class Base():
     def load_from_file(cls):
         """ Load all objects from file
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
-
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+        get_storage().load(cls)
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        get_storage().save_all(cls)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def flush(cls):
+        """ Write pending deferred saves now
+        Base.flush() writes every class, User.flush() only users
+        """
+        get_storage().flush(None if cls is Base else cls)
 
     def save(self):
         """ Save current object
         """
-        s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        get_storage().save(self)
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        get_storage().remove(self)
+
+    @classmethod
+    def save_many(cls, objs: Iterable[TypeVar('Base')]) -> List[bool]:
+        """ Save many objects at once: DATA and indexes are updated in
+        one pass and each class is persisted once
+        Return, per object, whether it was saved (False for objects that
+        are not instances of cls)
+        """
+        objs = list(objs)
+        results = [isinstance(obj, cls) for obj in objs]
+        valid = [obj for obj, ok in zip(objs, results) if ok]
+        now = datetime.utcnow()
+        for obj in valid:
+            obj.updated_at = now
+        get_storage().save_many(valid)
+        return results
+
+    @classmethod
+    def remove_many(cls, ids: Iterable[str]) -> List[bool]:
+        """ Remove many objects by ID at once, persisting the class once
+        Return, per ID, whether an object was removed
+        """
+        return get_storage().remove_many(cls, list(ids))
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
-        s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        return get_storage().count(cls)
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -118,20 +198,30 @@ class Base():
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
-        s_class = cls.__name__
-        return DATA[s_class].get(id)
+        return get_storage().get(cls, id)
 
     @classmethod
-    def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
+    def search(cls, attributes: dict = {},
+               limit: Optional[int] = None) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
+        limit=1 stops at the first match
+        """
+        return get_storage().search(cls, attributes, limit)
+
+    @classmethod
+    def iter_search(cls, attributes: dict = {}, limit: Optional[int] = None,
+                    offset: int = 0, order_by: Optional[str] = None
+                    ) -> Iterator[TypeVar('Base')]:
+        """ Yield objects with matching attributes lazily
+        order_by is an attribute name, prefixed with '-' for descending
+        """
+        return get_storage().iter_search(cls, attributes, limit, offset,
+                                         order_by)
+
+    @classmethod
+    def iter_values(cls, attribute: str) -> Iterator[Tuple[str, object]]:
+        """ Yield (id, value of `attribute`) for every object, without
+        building the objects when the backend can avoid it (timestamps
+        may then be strings)
         """
-        s_class = cls.__name__
-        def _search(obj):
-            if len(attributes) == 0:
-                return True
-            for k, v in attributes.items():
-                if (getattr(obj, k) != v):
-                    return False
-            return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+        return get_storage().iter_values(cls, attribute)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+""" Index module
+"""
+from bisect import bisect_left, insort
+from typing import Callable, Iterator, Optional, Tuple, TypeVar
+
+
+_MISSING = object()
+
+
+class Index():
+    """ Hash index of one attribute: value -> ids (an ordered {id: None})
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize an empty index on `attribute`
+        """
+        self.attribute = attribute
+        self.buckets = {}
+        self.values = {}
+
+    def add(self, obj: TypeVar('Base')):
+        """ Index (or re-index) an object under its current value
+        """
+        value = getattr(obj, self.attribute, None)
+        old = self.values.get(obj.id, _MISSING)
+        if old is not _MISSING and old == value:
+            return
+        self.discard(obj.id)
+        try:
+            self.buckets.setdefault(value, {})[obj.id] = None
+        except TypeError:
+            # Unhashable values can't match an equality lookup anyway
+            return
+        self.values[obj.id] = value
+
+    def discard(self, obj_id: str):
+        """ Remove an object from the index
+        """
+        value = self.values.pop(obj_id, _MISSING)
+        if value is _MISSING:
+            return
+        bucket = self.buckets[value]
+        del bucket[obj_id]
+        if not bucket:
+            del self.buckets[value]
+
+    def lookup(self, value) -> dict:
+        """ Return the ids indexed under `value`, as an ordered dict
+        Raise TypeError if `value` is unhashable
+        """
+        return self.buckets.get(value, {})
+
+    def clear(self):
+        """ Drop every entry
+        """
+        self.buckets = {}
+        self.values = {}
+
+
+class _Top():
+    """ Sorts after every id, to bisect past all keys of one value
+    """
+
+    def __lt__(self, other) -> bool:
+        """ Never smaller """
+        return False
+
+    def __gt__(self, other) -> bool:
+        """ Always greater """
+        return True
+
+
+_TOP = _Top()
+
+
+class SortedIndex():
+    """ Ordered index of one attribute: (value, id) keys sorted with bisect
+
+    Values go through `normalize` first (e.g. timestamp strings of lazy
+    records become datetime). None, and values that can't be ordered
+    against the indexed ones, are kept aside in `others` (an ordered
+    {id: None}): range and prefix queries still test them one by one.
+    """
+    BATCH = 64
+
+    def __init__(self, attribute: str,
+                 normalize: Optional[Callable] = None):
+        """ Initialize an empty sorted index on `attribute`
+        """
+        self.attribute = attribute
+        self.normalize = normalize
+        self.keys = []
+        self.values = {}
+        self.others = {}
+
+    def value(self, obj: TypeVar('Base')):
+        """ Return the normalized value of `obj`
+        """
+        value = getattr(obj, self.attribute, None)
+        if value is not None and self.normalize is not None:
+            try:
+                value = self.normalize(value)
+            except (TypeError, ValueError):
+                pass
+        return value
+
+    def add(self, obj: TypeVar('Base')):
+        """ Index (or re-index) an object under its current value
+        """
+        value = self.value(obj)
+        old = self.values.get(obj.id, _MISSING)
+        if old is not _MISSING and type(old) is type(value) \
+                and old == value:
+            return
+        self.discard(obj.id)
+        self.values[obj.id] = value
+        if value is None:
+            self.others[obj.id] = None
+            return
+        try:
+            insort(self.keys, (value, obj.id))
+        except TypeError:
+            self.others[obj.id] = None
+
+    def add_many(self, objs: list):
+        """ Index many objects; large batches re-sort once instead of
+        inserting one by one
+        """
+        if len(objs) < self.BATCH:
+            for obj in objs:
+                self.add(obj)
+            return
+        entries = {obj.id: self.value(obj) for obj in objs}
+        keys = [key for key in self.keys if key[1] not in entries]
+        keys.extend((value, obj_id) for obj_id, value in entries.items()
+                    if value is not None)
+        try:
+            keys.sort()
+        except TypeError:
+            for obj in objs:
+                self.add(obj)
+            return
+        self.keys = keys
+        for obj_id, value in entries.items():
+            self.others.pop(obj_id, None)
+            self.values[obj_id] = value
+            if value is None:
+                self.others[obj_id] = None
+
+    def discard(self, obj_id: str):
+        """ Remove an object from the index
+        """
+        value = self.values.pop(obj_id, _MISSING)
+        if value is _MISSING:
+            return
+        if obj_id in self.others:
+            del self.others[obj_id]
+            return
+        i = bisect_left(self.keys, (value, obj_id))
+        if i < len(self.keys) and self.keys[i][1] == obj_id:
+            del self.keys[i]
+
+    def bound(self, value):
+        """ Return a query bound normalized like the indexed values
+        """
+        if value is None or self.normalize is None:
+            return value
+        return self.normalize(value)
+
+    def span(self, low=None, high=None, include_low: bool = True,
+             include_high: bool = False) -> Tuple[int, int]:
+        """ Return the (start, stop) key positions of a value range
+        Raise TypeError if the bounds don't compare with the values
+        """
+        start, stop = 0, len(self.keys)
+        if low is not None:
+            low = self.bound(low)
+            key = (low,) if include_low else (low, _TOP)
+            start = bisect_left(self.keys, key)
+        if high is not None:
+            high = self.bound(high)
+            key = (high, _TOP) if include_high else (high,)
+            stop = max(start, bisect_left(self.keys, key))
+        return start, stop
+
+    def ids(self, start: int = 0, stop: Optional[int] = None,
+            reverse: bool = False) -> Iterator[str]:
+        """ Return the ids of keys[start:stop], in value order
+        """
+        keys = self.keys[start:stop]
+        if reverse:
+            keys.reverse()
+        return (obj_id for _, obj_id in keys)
+
+    def clear(self):
+        """ Drop every entry
+        """
+        self.keys = []
+        self.values = {}
+        self.others = {}
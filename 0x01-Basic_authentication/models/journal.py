@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+""" Journal module
+
+Append-only mutation log kept next to a `.db_<Class>.json` snapshot.
+Each line is a JSON array: ["save", <object JSON>] or ["remove", <id>].
+Records carry full object state, so replaying them over any snapshot
+taken before they were written gives the latest state.
+
+A crash mid-append leaves a torn last line (no newline): replay()
+truncates it away, and appends to a file that doesn't end with a
+newline start a new line, so later records are never glued onto it.
+"""
+from os import getenv, path
+from typing import Iterator, List, Tuple
+import json
+import os
+import threading
+from models.durability import fsync_directory, fsync_policy
+
+
+def journaling() -> bool:
+    """ Return True when MODEL_JOURNAL enables journaled storage
+    """
+    return getenv("MODEL_JOURNAL", "").lower() in ("1", "true", "yes", "on")
+
+
+def ends_torn(file_path: str) -> bool:
+    """ Return True if `file_path` is not empty and its last line has no
+    newline
+    """
+    if not path.exists(file_path) or path.getsize(file_path) == 0:
+        return False
+    with open(file_path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+
+def threshold() -> int:
+    """ Number of records after which the journal is compacted
+    """
+    return int(getenv("MODEL_JOURNAL_THRESHOLD", 1000))
+
+
+class Journal():
+    """ Journal of one model class
+
+    When compaction starts, the live journal is rotated to `<path>.old`
+    and new records go to a fresh file; the rotated file is deleted
+    once the new snapshot is on disk.
+    """
+
+    def __init__(self, file_path: str):
+        """ Initialize a Journal writing to `file_path`
+        """
+        self.path = file_path
+        self.rotated_path = file_path + ".old"
+        self.records = 0
+        self.lock = threading.Lock()
+        self.compaction = threading.Lock()
+        self._file = None
+
+    def append(self, op: str, payload) -> int:
+        """ Append one record and return the live record count
+        """
+        return self.extend([(op, payload)])
+
+    def extend(self, records: List[Tuple[str, object]]) -> int:
+        """ Append (op, payload) records with one write, return the live
+        record count
+        With MODEL_FSYNC=always they are on disk when this returns
+        """
+        lines = "".join(json.dumps([op, payload], separators=(',', ':'))
+                        + "\n" for op, payload in records)
+        sync = fsync_policy() == "always"
+        with self.lock:
+            created = self._file is None and not path.exists(self.path)
+            if self._file is None:
+                if ends_torn(self.path):
+                    lines = "\n" + lines
+                self._file = open(self.path, 'a')
+            self._file.write(lines)
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+                if created:
+                    fsync_directory(path.dirname(self.path))
+            self.records += len(records)
+            return self.records
+
+    def replay(self) -> Iterator[Tuple[str, object]]:
+        """ Yield (op, payload) for every record, oldest first
+        A torn last line (crash mid-append) is truncated from the file,
+        and a torn line a later append completed is skipped
+        """
+        self.records = 0
+        for file_path in (self.rotated_path, self.path):
+            if not path.exists(file_path):
+                continue
+            end = 0
+            with open(file_path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    end += len(line)
+                    try:
+                        op, payload = json.loads(line)
+                    except (TypeError, ValueError):
+                        continue
+                    if file_path == self.path:
+                        self.records += 1
+                    yield op, payload
+            with self.lock:
+                # Records appended since the loop hit EOF end with a
+                # newline: only a tail without one is torn
+                with open(file_path, 'rb') as f:
+                    f.seek(end)
+                    tail = f.read()
+                if tail and b"\n" not in tail:
+                    if file_path == self.path:
+                        self.close()
+                    os.truncate(file_path, end)
+
+    def exists(self) -> bool:
+        """ Return True if any journal file is on disk
+        """
+        return path.exists(self.path) or path.exists(self.rotated_path)
+
+    def rotate(self):
+        """ Move the live journal aside so new records start a new file
+        """
+        with self.lock:
+            self.close()
+            if not path.exists(self.path):
+                return
+            if not path.exists(self.rotated_path):
+                os.replace(self.path, self.rotated_path)
+                self.records = 0
+                return
+            # An earlier compaction never finished: keep both, in order
+            torn = ends_torn(self.rotated_path)
+            with open(self.path, 'r') as src, \
+                    open(self.rotated_path, 'a') as dst:
+                if torn:
+                    dst.write("\n")
+                dst.write(src.read())
+                if fsync_policy() != "never":
+                    dst.flush()
+                    os.fsync(dst.fileno())
+            os.remove(self.path)
+            self.records = 0
+
+    def discard_rotated(self):
+        """ Delete the rotated journal once a snapshot covers it
+        """
+        if path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
+
+    def clear(self):
+        """ Delete every journal file
+        """
+        with self.lock:
+            self.close()
+            for file_path in (self.path, self.rotated_path):
+                if path.exists(file_path):
+                    os.remove(file_path)
+            self.records = 0
+
+    def close(self):
+        """ Close the append handle
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
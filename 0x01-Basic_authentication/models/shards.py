@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+""" Shards module
+
+Splits the snapshot of a class across MODEL_SHARDS files by id hash,
+`.db_<Class>.<i>of<N>.json` (or `.bin`) for i in 0..N-1, so a mutation
+rewrites only the shard holding the object and loading reads the shards
+in parallel. With one shard (the default) the snapshot stays the single
+`.db_<Class>.json` file. Objects are loaded shard after shard, so with
+several the order of all() is no longer the order of creation.
+
+The shard count of existing files is changed offline with reshard.py.
+"""
+from os import getenv
+from typing import Iterable, List, Tuple
+import os
+import re
+import zlib
+
+
+SHARD_NAME = re.compile(r"^\.db_(\w+?)\.(?:(\d+)of(\d+)\.)?(json|bin)$")
+
+
+def shard_count() -> int:
+    """ Return the number of snapshot files per class from MODEL_SHARDS
+    """
+    count = int(getenv("MODEL_SHARDS", 1))
+    if count < 1:
+        raise ValueError("MODEL_SHARDS must be at least 1")
+    return count
+
+
+def shard_of(obj_id: str, count: int) -> int:
+    """ Return the shard of `obj_id` among `count`
+    crc32, unlike hash(), is the same in every process and version
+    """
+    if count == 1:
+        return 0
+    return zlib.crc32(obj_id.encode()) % count
+
+
+def shard_paths(s_class: str, extension: str, count: int) -> List[str]:
+    """ Return the snapshot files of class `s_class` split in `count`
+    """
+    if count == 1:
+        return [".db_{}.{}".format(s_class, extension)]
+    return [".db_{}.{}of{}.{}".format(s_class, i, count, extension)
+            for i in range(count)]
+
+
+def partition(objs: Iterable, count: int) -> List[list]:
+    """ Return `objs` split by shard
+    """
+    parts = [[] for _ in range(count)]
+    if count == 1:
+        parts[0].extend(objs)
+        return parts
+    crc32 = zlib.crc32
+    # shard_of() inlined: this runs over every object of a class
+    for obj in objs:
+        parts[crc32(obj.id.encode()) % count].append(obj)
+    return parts
+
+
+def layouts(s_class: str, dir_path: str = ".") -> List[Tuple[int, str]]:
+    """ Return the (shard count, extension) of every snapshot layout of
+    class `s_class` found in `dir_path`
+    """
+    found = set()
+    for name in os.listdir(dir_path):
+        match = SHARD_NAME.match(name)
+        if match is None or match.group(1) != s_class:
+            continue
+        found.add((int(match.group(3) or 1), match.group(4)))
+    return sorted(found)
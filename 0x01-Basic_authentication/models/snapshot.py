@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+""" Snapshot module
+
+Binary snapshot format (MODEL_SNAPSHOT_FORMAT=binary), stored in
+`.db_<Class>.bin` instead of the `.db_<Class>.json` text file.
+
+    prefix   magic b"MSNP", version (u8), flags (u8), record count (u32),
+             field count (u16)
+    body     field names (u16 length + UTF-8 each), then the records
+
+Each record is its length (u32) followed by a fixed header, one tag (u8)
+per field then one slot (i32) per field, and the variable-size values.
+The slot holds the byte length of strings and JSON, or the value of
+small integers, so a whole header decodes with one struct call.
+
+Timestamps are stored as calendar fields (year u16, month, day, hour,
+minute, second u8, microsecond u32) and decode straight into datetime.
+Values that are not str, int, float, bool, None or datetime are stored
+as JSON. With FLAG_ZLIB (MODEL_SNAPSHOT_COMPRESS) the body is a zlib
+stream. Integers are little-endian.
+"""
+from datetime import datetime
+from os import getenv
+from typing import Iterable, List
+import json
+import struct
+import zlib
+from models.timestamps import TIMESTAMP_FIELDS, format_timestamp, \
+    parse_timestamp
+
+
+MAGIC = b"MSNP"
+VERSION = 1
+FLAG_ZLIB = 0x01
+
+PREFIX = struct.Struct("<4sBBIH")
+LENGTH = struct.Struct("<I")
+NAME_LENGTH = struct.Struct("<H")
+INT64 = struct.Struct("<q")
+FLOAT = struct.Struct("<d")
+TIMESTAMP = struct.Struct("<HBBBBBI")
+
+(TAG_MISSING, TAG_NONE, TAG_STR, TAG_INT, TAG_INT64, TAG_FLOAT, TAG_TRUE,
+ TAG_FALSE, TAG_TIMESTAMP, TAG_JSON) = range(10)
+
+INT32_MIN, INT32_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+def snapshot_format() -> str:
+    """ Return the snapshot file format from MODEL_SNAPSHOT_FORMAT
+    """
+    name = getenv("MODEL_SNAPSHOT_FORMAT", "json").lower()
+    if name not in ("json", "binary"):
+        raise ValueError("unknown MODEL_SNAPSHOT_FORMAT: {}".format(name))
+    return name
+
+
+def compression() -> bool:
+    """ Return True when MODEL_SNAPSHOT_COMPRESS zlib-compresses binary
+    snapshots
+    """
+    value = getenv("MODEL_SNAPSHOT_COMPRESS", "")
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def header(count: int) -> struct.Struct:
+    """ Return the record header layout of `count` fields
+    """
+    return struct.Struct("<{}B{}i".format(count, count))
+
+
+def encode_value(value, payload: list) -> tuple:
+    """ Return the (tag, slot) of `value`, appending its bytes to payload
+    """
+    if value is None:
+        return TAG_NONE, 0
+    kind = type(value)
+    if kind is str:
+        data = value.encode()
+        payload.append(data)
+        return TAG_STR, len(data)
+    if kind is bool:
+        return (TAG_TRUE if value else TAG_FALSE), 0
+    if kind is int:
+        if INT32_MIN <= value <= INT32_MAX:
+            return TAG_INT, value
+        if -2 ** 63 <= value < 2 ** 63:
+            payload.append(INT64.pack(value))
+            return TAG_INT64, 0
+    elif kind is float:
+        payload.append(FLOAT.pack(value))
+        return TAG_FLOAT, 0
+    elif kind is datetime and value.tzinfo is None:
+        payload.append(TIMESTAMP.pack(
+            value.year, value.month, value.day, value.hour, value.minute,
+            value.second, value.microsecond))
+        return TAG_TIMESTAMP, 0
+    data = json.dumps(value).encode()
+    payload.append(data)
+    return TAG_JSON, len(data)
+
+
+def encode(records: Iterable[dict], compress: bool = False) -> bytes:
+    """ Return the binary snapshot of `records` (dictionaries whose
+    timestamps may be datetime values)
+    """
+    records = list(records)
+    fields = {}
+    for record in records:
+        for name in record:
+            fields.setdefault(name, None)
+    fields = list(fields)
+    record_header = header(len(fields))
+
+    chunks = []
+    for name in fields:
+        data = name.encode()
+        chunks.append(NAME_LENGTH.pack(len(data)))
+        chunks.append(data)
+    for record in records:
+        tags, slots, payload = [], [], []
+        for name in fields:
+            if name in record:
+                tag, slot = encode_value(record[name], payload)
+            else:
+                tag, slot = TAG_MISSING, 0
+            tags.append(tag)
+            slots.append(slot)
+        data = record_header.pack(*tags, *slots) + b"".join(payload)
+        chunks.append(LENGTH.pack(len(data)))
+        chunks.append(data)
+
+    body = b"".join(chunks)
+    flags = 0
+    if compress:
+        body = zlib.compress(body)
+        flags |= FLAG_ZLIB
+    return PREFIX.pack(MAGIC, VERSION, flags, len(records),
+                       len(fields)) + body
+
+
+def decode(data: bytes, native: bool = True) -> List[dict]:
+    """ Return the records of a binary snapshot
+    With native=False timestamps are formatted as in the JSON files
+    """
+    if len(data) < PREFIX.size:
+        raise ValueError("truncated snapshot")
+    magic, version, flags, count, field_count = PREFIX.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("not a binary snapshot")
+    if version != VERSION:
+        raise ValueError("unsupported snapshot version {}".format(version))
+    body = data[PREFIX.size:]
+    if flags & FLAG_ZLIB:
+        body = zlib.decompress(body)
+
+    pos = 0
+    fields = []
+    for _ in range(field_count):
+        (size,) = NAME_LENGTH.unpack_from(body, pos)
+        pos += NAME_LENGTH.size
+        fields.append(body[pos:pos + size].decode())
+        pos += size
+    record_header = header(field_count)
+    header_size = record_header.size
+    unpack_header = record_header.unpack_from
+    unpack_length = LENGTH.unpack_from
+    unpack_timestamp = TIMESTAMP.unpack_from
+    timestamp_size = TIMESTAMP.size
+    columns = list(enumerate(fields, field_count))
+
+    records = []
+    for _ in range(count):
+        (size,) = unpack_length(body, pos)
+        pos += LENGTH.size
+        end = pos + size
+        values = unpack_header(body, pos)
+        pos += header_size
+        record = {}
+        for tag, (i, name) in zip(values, columns):
+            if tag == TAG_STR:
+                size = values[i]
+                record[name] = body[pos:pos + size].decode()
+                pos += size
+            elif tag == TAG_TIMESTAMP:
+                value = datetime(*unpack_timestamp(body, pos))
+                record[name] = value if native else format_timestamp(value)
+                pos += timestamp_size
+            elif tag == TAG_NONE:
+                record[name] = None
+            elif tag == TAG_INT:
+                record[name] = values[i]
+            elif tag == TAG_TRUE:
+                record[name] = True
+            elif tag == TAG_FALSE:
+                record[name] = False
+            elif tag == TAG_INT64:
+                (record[name],) = INT64.unpack_from(body, pos)
+                pos += INT64.size
+            elif tag == TAG_FLOAT:
+                (record[name],) = FLOAT.unpack_from(body, pos)
+                pos += FLOAT.size
+            elif tag == TAG_JSON:
+                size = values[i]
+                record[name] = json.loads(body[pos:pos + size])
+                pos += size
+            elif tag != TAG_MISSING:
+                raise ValueError("unknown value tag {}".format(tag))
+        if pos != end:
+            raise ValueError("corrupt snapshot record")
+        records.append(record)
+    return records
+
+
+def json_to_binary(json_path: str, binary_path: str,
+                   compress: bool = False) -> int:
+    """ Convert a `.db_<Class>.json` file to a binary snapshot
+    Timestamp strings become native timestamps. Return the record count
+    """
+    with open(json_path, 'r') as f:
+        records = list(json.load(f).values())
+    for record in records:
+        for name in TIMESTAMP_FIELDS:
+            if type(record.get(name)) is str:
+                record[name] = parse_timestamp(record[name])
+    with open(binary_path, 'wb') as f:
+        f.write(encode(records, compress))
+    return len(records)
+
+
+def binary_to_json(binary_path: str, json_path: str) -> int:
+    """ Convert a binary snapshot to a `.db_<Class>.json` file
+    Return the record count
+    """
+    with open(binary_path, 'rb') as f:
+        records = decode(f.read(), native=False)
+    with open(json_path, 'w') as f:
+        f.write(json.dumps({record['id']: record for record in records}))
+    return len(records)
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+""" SQLite storage module
+
+One table per model class: `id` primary key, `created_at`/`updated_at`,
+one indexed column per entry of the class `indexed_attributes` and
+`sorted_attributes`, and the full object JSON in `data`. Rows are only
+hydrated into objects when a query returns them, so datasets do not have
+to fit in memory.
+"""
+from datetime import datetime
+from typing import Iterator, TypeVar, List, Optional, Tuple
+from os import path
+import json
+import re
+import sqlite3
+import threading
+import weakref
+from models.durability import fsync_policy
+from models.query import Predicate, Prefix, Range
+from models.storage import Storage, matches, page
+from models.timestamps import format_timestamp
+
+
+IDENTIFIER = re.compile(r"^\w+$")
+# MODEL_FSYNC policy -> PRAGMA synchronous (the WAL is the journal)
+SYNCHRONOUS = {"never": "OFF", "on-flush": "NORMAL", "always": "FULL"}
+
+
+def quote(name: str) -> str:
+    """ Quote a table or column name
+    """
+    if not IDENTIFIER.match(name):
+        raise ValueError("invalid SQL identifier: {!r}".format(name))
+    return '"{}"'.format(name)
+
+
+def bound_value(value):
+    """ Return a Range bound as a column value, None if the TEXT column
+    order does not match the attribute order
+    """
+    if type(value) is datetime:
+        # Stored timestamps are truncated to the second
+        if value.microsecond or value.tzinfo is not None:
+            return None
+        return format_timestamp(value)
+    if isinstance(value, (str, int, float)):
+        return value
+    return None
+
+
+def condition(column: str,
+              predicate: Predicate) -> Optional[Tuple[str, list]]:
+    """ Return the SQL condition and parameters of a predicate on
+    `column`, None if it can't be expressed exactly
+    """
+    column = quote(column)
+    where, params = [], []
+    if isinstance(predicate, Range):
+        for value, include, op in (
+                (predicate.low, predicate.include_low, ">"),
+                (predicate.high, predicate.include_high, "<")):
+            if value is None:
+                continue
+            value = bound_value(value)
+            if value is None:
+                return None
+            where.append("{} {}{} ?".format(column, op,
+                                            "=" if include else ""))
+            params.append(value)
+        if not where:
+            where.append("{} IS NOT NULL".format(column))
+    elif isinstance(predicate, Prefix):
+        where.append("{} >= ?".format(column))
+        params.append(predicate.prefix)
+        upper = predicate.upper()
+        if upper is not None:
+            where.append("{} < ?".format(column))
+            params.append(upper)
+    else:
+        return None
+    return " AND ".join(where), params
+
+
+def column_value(value):
+    """ Return `value` as something sqlite3 can bind
+    """
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    return json.dumps(value)
+
+
+class SQLiteStorage(Storage):
+    """ SQLite backend
+
+    Each thread gets its own connection (WAL journal mode, so readers
+    don't block the writer; synchronous level from MODEL_FSYNC, NORMAL
+    when unset). Hydrated objects are kept in a weak
+    identity map: while a caller holds an object, get() and search()
+    return that same instance.
+    """
+
+    def __init__(self, db_path: str):
+        """ Initialize the backend on the database file `db_path`
+        """
+        self.db_path = db_path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.tables = set()
+        self.identity = {}
+
+    def connection(self) -> sqlite3.Connection:
+        """ Return the connection of the calling thread
+        """
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous={}".format(
+                SYNCHRONOUS[fsync_policy("on-flush")]))
+            self.local.conn = conn
+        return conn
+
+    @staticmethod
+    def columns(cls: type) -> List[str]:
+        """ Return the queryable columns of `cls`, besides `data`
+        """
+        columns = ['id', 'created_at', 'updated_at']
+        for attr in cls.indexed_attributes + cls.sorted_attributes:
+            if attr not in columns:
+                columns.append(attr)
+        return columns
+
+    def table(self, cls: type) -> str:
+        """ Create (or migrate) the table of `cls`; return its quoted name
+        """
+        s_class = cls.__name__
+        table = quote(s_class)
+        if s_class in self.tables:
+            return table
+        conn = self.connection()
+        with self.lock, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS {} (id TEXT PRIMARY KEY, "
+                "created_at TEXT, updated_at TEXT, data TEXT NOT NULL)"
+                .format(table))
+            existing = {row[1] for row in conn.execute(
+                "PRAGMA table_info({})".format(table))}
+            for column in self.columns(cls)[1:]:
+                if column not in existing:
+                    # Columns added to indexed_attributes later
+                    conn.execute("ALTER TABLE {} ADD COLUMN {}".format(
+                        table, quote(column)))
+                    conn.execute(
+                        "UPDATE {} SET {} = json_extract(data, ?)".format(
+                            table, quote(column)), ("$." + column,))
+                index = quote("ix_{}_{}".format(s_class, column))
+                conn.execute("CREATE INDEX IF NOT EXISTS {} ON {} ({})"
+                             .format(index, table, quote(column)))
+            self.tables.add(s_class)
+            self.identity.setdefault(s_class, weakref.WeakValueDictionary())
+        return table
+
+    def hydrate(self, cls: type, obj_id: str,
+                data: str) -> TypeVar('Base'):
+        """ Return the live instance of a row, building it if needed
+        """
+        identity = self.identity[cls.__name__]
+        with self.lock:
+            obj = identity.get(obj_id)
+            if obj is None:
+                obj = cls(**json.loads(data))
+                identity[obj_id] = obj
+        return obj
+
+    def row(self, obj: TypeVar('Base')) -> list:
+        """ Return the column values of `obj`, `data` last
+        """
+        obj_json = obj.to_json(True)
+        return [column_value(obj_json.get(column))
+                for column in self.columns(obj.__class__)] + \
+            [json.dumps(obj_json)]
+
+    def upsert(self, cls: type, rows: List[list]):
+        """ Insert or update rows in one transaction
+        """
+        table = self.table(cls)
+        columns = self.columns(cls) + ['data']
+        conn = self.connection()
+        with conn:
+            conn.executemany(
+                "INSERT INTO {} ({}) VALUES ({}) ON CONFLICT(id) DO UPDATE "
+                "SET {}".format(
+                    table, ", ".join(quote(c) for c in columns),
+                    ", ".join("?" * len(columns)),
+                    ", ".join("{0} = excluded.{0}".format(quote(c))
+                              for c in columns[1:])),
+                rows)
+
+    def load(self, cls: type):
+        """ Prepare the table of `cls`
+        An empty table is seeded from an existing `.db_<Class>.json`
+        """
+        s_class = cls.__name__
+        table = self.table(cls)
+        with self.lock:
+            self.identity[s_class] = weakref.WeakValueDictionary()
+        file_path = ".db_{}.json".format(s_class)
+        if self.count(cls) > 0 or not path.exists(file_path):
+            return
+        with open(file_path, 'r') as f:
+            objs_json = json.load(f)
+        self.upsert(cls, [self.row(cls(**obj_json))
+                          for obj_json in objs_json.values()])
+
+    def update(self, cls: type, rows: List[list]):
+        """ Update existing rows in one transaction, skipping deleted ones
+        """
+        table = self.table(cls)
+        columns = self.columns(cls) + ['data']
+        conn = self.connection()
+        with conn:
+            conn.executemany(
+                "UPDATE {} SET {} WHERE id = ?".format(
+                    table, ", ".join("{} = ?".format(quote(c))
+                                     for c in columns[1:])),
+                [row[1:] + row[:1] for row in rows])
+
+    def save_all(self, cls: type):
+        """ Write every live instance of `cls`
+        Rows removed meanwhile by another thread are not brought back
+        """
+        self.table(cls)
+        with self.lock:
+            objs = list(self.identity[cls.__name__].values())
+        self.update(cls, [self.row(obj) for obj in objs])
+
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or update one row
+        """
+        cls = obj.__class__
+        self.upsert(cls, [self.row(obj)])
+        with self.lock:
+            self.identity[cls.__name__][obj.id] = obj
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete one row
+        """
+        self.remove_many(obj.__class__, [obj.id])
+
+    def save_many(self, objs: List[TypeVar('Base')]):
+        """ Insert or update rows, one transaction per class
+        """
+        by_class = {}
+        for obj in objs:
+            by_class.setdefault(obj.__class__, []).append(obj)
+        for cls, group in by_class.items():
+            self.upsert(cls, [self.row(obj) for obj in group])
+            with self.lock:
+                identity = self.identity[cls.__name__]
+                for obj in group:
+                    identity[obj.id] = obj
+
+    def remove_many(self, cls: type, ids: List[str]) -> List[bool]:
+        """ Delete rows by ID in one transaction
+        Return, per ID, whether a row was deleted
+        """
+        query = "DELETE FROM {} WHERE id = ?".format(self.table(cls))
+        conn = self.connection()
+        with conn:
+            results = [conn.execute(query, (obj_id,)).rowcount > 0
+                       for obj_id in ids]
+        with self.lock:
+            identity = self.identity[cls.__name__]
+            for obj_id in ids:
+                identity.pop(obj_id, None)
+        return results
+
+    def count(self, cls: type) -> int:
+        """ Count all rows
+        """
+        return self.connection().execute(
+            "SELECT COUNT(*) FROM {}".format(self.table(cls))).fetchone()[0]
+
+    def get(self, cls: type, id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        table = self.table(cls)
+        with self.lock:
+            obj = self.identity[cls.__name__].get(id)
+        if obj is not None:
+            return obj
+        row = self.connection().execute(
+            "SELECT id, data FROM {} WHERE id = ?".format(table),
+            (id,)).fetchone()
+        return None if row is None else self.hydrate(cls, *row)
+
+    def iter_values(self, cls: type,
+                    attribute: str) -> Iterator[Tuple[str, object]]:
+        """ Yield (id, value of `attribute`) for every row, read from its
+        column or the JSON without hydrating the row
+        """
+        table = self.table(cls)
+        conn = self.connection()
+        if attribute in self.columns(cls):
+            return iter(conn.execute("SELECT id, {} FROM {} ORDER BY rowid"
+                                     .format(quote(attribute), table)))
+        rows = conn.execute("SELECT id, data FROM {} ORDER BY rowid"
+                            .format(table))
+        return ((obj_id, json.loads(data).get(attribute))
+                for obj_id, data in rows)
+
+    def iter_search(self, cls: type, attributes: dict,
+                    limit: Optional[int] = None, offset: int = 0,
+                    order_by: Optional[str] = None
+                    ) -> Iterator[TypeVar('Base')]:
+        """ Search objects with matching attributes lazily
+        Indexed attributes are filtered in SQL, the rest in Python;
+        Range and Prefix predicates on columns become range conditions
+        the column indexes answer. Ordering and paging run in SQL when
+        the whole query does.
+        """
+        table = self.table(cls)
+        columns = self.columns(cls)
+        where, params = [], []
+        exact = True
+        for k, v in attributes.items():
+            if k not in columns:
+                exact = False
+            elif isinstance(v, Predicate):
+                sql = condition(k, v)
+                if sql is None:
+                    exact = False
+                else:
+                    where.append(sql[0])
+                    params.extend(sql[1])
+            elif k in ('created_at', 'updated_at'):
+                exact = False
+            elif v is None:
+                where.append("{} IS NULL".format(quote(k)))
+            elif isinstance(v, (str, int, float)):
+                where.append("{} = ?".format(quote(k)))
+                params.append(v)
+            else:
+                exact = False
+        query = "SELECT id, data FROM {}".format(table)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+
+        order_column = None if order_by is None else order_by.lstrip('-')
+        in_sql = exact and (order_column is None or order_column in columns)
+        if in_sql and order_column is not None:
+            direction = "DESC" if order_by.startswith('-') else "ASC"
+            query += " ORDER BY {0} IS NULL {1}, {0} {1}, rowid".format(
+                quote(order_column), direction)
+        else:
+            query += " ORDER BY rowid"
+        if in_sql and (limit is not None or offset):
+            query += " LIMIT ? OFFSET ?"
+            params.extend([-1 if limit is None else limit, offset])
+
+        objs = (self.hydrate(cls, *row)
+                for row in self.connection().execute(query, params))
+        objs = (obj for obj in objs if matches(obj, attributes))
+        if in_sql:
+            return objs
+        return page(objs, limit, offset, order_by)
@@ -0,0 +1,931 @@
+#!/usr/bin/env python3
+""" Storage module
+
+Backends behind the Base model API. MODEL_STORAGE selects one:
+- json (default): every object lives in DATA, persisted to
+  `.db_<Class>.json` (optionally journaled, flushed in the background,
+  loaded lazily, shared by several processes, see coherence, stored
+  as `.db_<Class>.bin`, see snapshot, or split in shards, see shards)
+- sqlite: one table per class in MODEL_SQLITE_PATH, see sqlite_storage
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+from functools import partial
+from itertools import islice
+from os import getenv, path
+from typing import Callable, Iterable, Iterator, TypeVar, List, Optional, \
+    Tuple
+import heapq
+import json
+import mmap
+import threading
+from models.coherence import FileLock, coherent, stamp
+from models.durability import atomic_write, fsync_policy
+from models.flusher import Flusher, flush_interval
+from models.index import Index, SortedIndex
+from models.journal import Journal, journaling, threshold
+from models.query import Predicate, Prefix, Range
+from models.rwlock import RWLock
+from models.shards import layouts, partition, shard_count, shard_of, \
+    shard_paths
+from models.snapshot import compression, decode, encode, snapshot_format
+from models.timestamps import TIMESTAMP_FIELDS, format_timestamp, \
+    parse_timestamp
+
+
+DATA = {}
+STORAGES = {}
+
+
+def lazy_loading() -> bool:
+    """ Return True when MODEL_LAZY_LOAD defers building loaded objects
+    """
+    value = getenv("MODEL_LAZY_LOAD", "")
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def journaled() -> bool:
+    """ Return True when saves go to the journal
+    MODEL_COHERENCE takes precedence over MODEL_JOURNAL: processes merge
+    their changes into the shared snapshot instead
+    """
+    return journaling() and not coherent()
+
+
+def mmap_loading() -> bool:
+    """ Return True when MODEL_LOAD_MMAP maps snapshot files into memory
+    """
+    value = getenv("MODEL_LOAD_MMAP", "")
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+class Record():
+    """ A loaded but not yet hydrated object: its raw JSON dictionary
+
+    Attribute reads fall through to the JSON values, which is what
+    indexes need; JSONStorage swaps the record for a real instance the
+    first time get() or search() returns it.
+
+    Records loaded from binary snapshots are `native`: their timestamps
+    may be datetime values.
+    """
+    __slots__ = ('id', 'raw', 'native')
+
+    def __init__(self, raw: dict, native: bool = False):
+        """ Wrap the JSON dictionary of one object
+        """
+        self.id = raw.get('id')
+        self.raw = raw
+        self.native = native
+
+    def __getattr__(self, name: str):
+        """ Read an attribute from the JSON dictionary
+        """
+        return self.raw.get(name)
+
+    def to_json(self, for_serialization: bool = False) -> dict:
+        """ Return the JSON dictionary
+        """
+        if not self.native:
+            return self.raw
+        return {k: format_timestamp(v) if type(v) is datetime else v
+                for k, v in self.raw.items()}
+
+    def to_native(self) -> dict:
+        """ Return the dictionary, datetime values included
+        """
+        return self.raw
+
+
+def matches(obj: TypeVar('Base'), attributes: dict) -> bool:
+    """ Return True if every attribute of `obj` equals the query value,
+    or satisfies it when the value is a Predicate
+    """
+    for k, v in attributes.items():
+        value = getattr(obj, k)
+        if isinstance(v, Predicate):
+            if not v.match(value):
+                return False
+        elif (value != v):
+            return False
+    return True
+
+
+def span(index: SortedIndex, predicate: Predicate) -> Tuple[int, int]:
+    """ Return the key positions of `index` that may satisfy `predicate`
+    Raise TypeError (or ValueError for a bound the index can't
+    normalize) if the index can't answer it
+    """
+    if isinstance(predicate, Range):
+        return index.span(predicate.low, predicate.high,
+                          predicate.include_low, predicate.include_high)
+    if isinstance(predicate, Prefix) and index.normalize is None:
+        return index.span(predicate.prefix, predicate.upper())
+    raise TypeError("no sorted index lookup for {!r}".format(predicate))
+
+
+def sort_key(order_by: str) -> Callable:
+    """ Return the sort key of `order_by` ("attribute" or "-attribute")
+    None values sort after every other value
+    """
+    attribute = order_by.lstrip('-')
+
+    def _key(obj):
+        """ (is None, value) so None is never compared to a value """
+        value = getattr(obj, attribute, None)
+        return (value is None, 0 if value is None else value)
+    return _key
+
+
+def ordered(objs: Iterable, order_by: str,
+            limit: Optional[int] = None) -> List:
+    """ Sort objects by `order_by`, keeping only the first `limit`
+    """
+    key = sort_key(order_by)
+    descending = order_by.startswith('-')
+    if limit is None:
+        return sorted(objs, key=key, reverse=descending)
+    if descending:
+        return heapq.nlargest(limit, objs, key=key)
+    return heapq.nsmallest(limit, objs, key=key)
+
+
+def page(objs: Iterable, limit: Optional[int] = None, offset: int = 0,
+         order_by: Optional[str] = None) -> Iterator:
+    """ Apply ordering, offset and limit to matching objects lazily
+    """
+    stop = None if limit is None else offset + limit
+    if order_by is not None:
+        objs = ordered(objs, order_by, stop)
+    return islice(objs, offset, stop)
+
+
+class Storage():
+    """ Storage backend interface
+    """
+
+    def load(self, cls: type):
+        """ Make the stored objects of `cls` available
+        """
+        raise NotImplementedError()
+
+    def save_all(self, cls: type):
+        """ Persist every object of `cls`
+        """
+        raise NotImplementedError()
+
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or update one object
+        """
+        raise NotImplementedError()
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete one object
+        """
+        raise NotImplementedError()
+
+    def save_many(self, objs: List[TypeVar('Base')]):
+        """ Insert or update many objects
+        """
+        for obj in objs:
+            self.save(obj)
+
+    def remove_many(self, cls: type, ids: List[str]) -> List[bool]:
+        """ Delete the objects of `cls` with the given IDs
+        Return, per ID, whether an object was removed
+        """
+        results = []
+        for obj_id in ids:
+            obj = self.get(cls, obj_id)
+            if obj is not None:
+                self.remove(obj)
+            results.append(obj is not None)
+        return results
+
+    def flush(self, cls: Optional[type] = None):
+        """ Write pending changes of `cls` (every class when None)
+        """
+
+    def count(self, cls: type) -> int:
+        """ Count the objects of `cls`
+        """
+        raise NotImplementedError()
+
+    def get(self, cls: type, id: str) -> TypeVar('Base'):
+        """ Return one object by ID, or None
+        """
+        raise NotImplementedError()
+
+    def iter_search(self, cls: type, attributes: dict,
+                    limit: Optional[int] = None, offset: int = 0,
+                    order_by: Optional[str] = None
+                    ) -> Iterator[TypeVar('Base')]:
+        """ Yield the objects whose attributes equal `attributes`
+        """
+        raise NotImplementedError()
+
+    def search(self, cls: type, attributes: dict,
+               limit: Optional[int] = None) -> List[TypeVar('Base')]:
+        """ Return the objects whose attributes equal `attributes`
+        """
+        return list(self.iter_search(cls, attributes, limit))
+
+    def iter_values(self, cls: type,
+                    attribute: str) -> Iterator[Tuple[str, object]]:
+        """ Yield (id, value of `attribute`) for every object of `cls`
+        """
+        for obj in self.iter_search(cls, {}):
+            yield obj.id, getattr(obj, attribute, None)
+
+
+class JSONStorage(Storage):
+    """ In-memory store persisted to one JSON file per class
+
+    Indexes reflect each object as of its last save() (or load): hash
+    indexes on `indexed_attributes` for equality, and sorted indexes on
+    `sorted_attributes`, built on first use, for Range and Prefix
+    predicates and ordering.
+    In lazy mode DATA first holds a Record per loaded object, and the
+    instance (including its timestamp parsing) is only built on access.
+
+    Each class has a readers-writer lock: save(), remove(), load() and
+    hydration change DATA and the indexes under its write lock, and
+    searches and snapshot writes copy what they need under its read
+    lock, then work on the copy without holding it. load() replaces the
+    dict of the class, so DATA is only looked up under the lock. Journal
+    records are appended under the write lock too, in the order of the
+    changes; snapshot writes wait until it is released.
+    Changes not written yet (`pending` ids) survive a load().
+
+    With several shards, save() and remove() record the shards they
+    changed (`dirty_shards`), and snapshot writes rewrite only those.
+
+    In coherence mode the backend remembers, per class, the snapshot
+    JSON it last read or wrote (`synced`) and the file stamps it had.
+    Objects whose JSON differs from `synced` were changed by this
+    process; everything else follows the file, which is reloaded when
+    its stamp changes.
+    """
+
+    def __init__(self):
+        """ Initialize the backend
+        """
+        self.indexes_by_class = {}
+        self.sorted_by_class = {}
+        self.dirty_shards = {}
+        self.pending = {}
+        self.journals = {}
+        self.flusher = Flusher(self.write)
+        self.locks = {}
+        self.writing = {}
+        self.requested = {}
+        self.written = {}
+        self.lock_files = {}
+        self.stamps = {}
+        self.synced = {}
+        self.locks_lock = threading.Lock()
+
+    @staticmethod
+    def file_path(cls: type) -> str:
+        """ Return the unsharded snapshot file of `cls` in
+        MODEL_SNAPSHOT_FORMAT, which also names its lock file
+        """
+        extension = "bin" if snapshot_format() == "binary" else "json"
+        return ".db_{}.{}".format(cls.__name__, extension)
+
+    @staticmethod
+    def file_paths(cls: type) -> List[str]:
+        """ Return the snapshot files of `cls`, one per shard
+        """
+        extension = "bin" if snapshot_format() == "binary" else "json"
+        return shard_paths(cls.__name__, extension, shard_count())
+
+    def source_paths(self, cls: type) -> List[str]:
+        """ Return the snapshot files to load: those of the configured
+        format, or the other format's files when only those exist
+        (MODEL_SNAPSHOT_FORMAT changed since they were written)
+        Raise ValueError if the files on disk have another shard count
+        """
+        paths = []
+        for file_path in self.file_paths(cls):
+            if not path.exists(file_path):
+                root, extension = path.splitext(file_path)
+                other = root + (".json" if extension == ".bin" else ".bin")
+                if path.exists(other):
+                    file_path = other
+            paths.append(file_path)
+        if not any(path.exists(file_path) for file_path in paths):
+            for count, _ in layouts(cls.__name__):
+                if count != len(paths):
+                    raise ValueError(
+                        "{} is stored in {} shard(s) but MODEL_SHARDS is "
+                        "{}, run reshard.py".format(
+                            cls.__name__, count, len(paths)))
+        return paths
+
+    def stamp(self, cls: type) -> tuple:
+        """ Return the stamps of the snapshot files of `cls`
+        """
+        return tuple(stamp(file_path) for file_path in self.file_paths(cls))
+
+    def lock(self, cls: type) -> RWLock:
+        """ Return the readers-writer lock guarding DATA of `cls`
+        """
+        s_class = cls.__name__
+        lock = self.locks.get(s_class)
+        if lock is None:
+            with self.locks_lock:
+                lock = self.locks.setdefault(s_class, RWLock())
+        return lock
+
+    def file_lock(self, cls: type) -> threading.Lock:
+        """ Return the lock serializing snapshot writes of `cls`
+        """
+        s_class = cls.__name__
+        lock = self.writing.get(s_class)
+        if lock is None:
+            with self.locks_lock:
+                lock = self.writing.setdefault(s_class, threading.Lock())
+        return lock
+
+    def lock_file(self, cls: type) -> FileLock:
+        """ Return the inter-process lock of the snapshot of `cls`
+        """
+        s_class = cls.__name__
+        lock = self.lock_files.get(s_class)
+        if lock is None:
+            with self.locks_lock:
+                lock = self.lock_files.get(s_class)
+                if lock is None:
+                    lock = FileLock(self.file_path(cls) + ".lock")
+                    self.lock_files[s_class] = lock
+        return lock
+
+    def indexes(self, cls: type) -> dict:
+        """ Return the {attribute: Index} of `cls`
+        """
+        s_class = cls.__name__
+        if self.indexes_by_class.get(s_class) is None:
+            indexes = {attr: Index(attr) for attr in cls.indexed_attributes}
+            for obj in DATA.get(s_class, {}).values():
+                for index in indexes.values():
+                    index.add(obj)
+            self.indexes_by_class[s_class] = indexes
+        return self.indexes_by_class[s_class]
+
+    def sorted_indexes(self, cls: type) -> dict:
+        """ Return the {attribute: SortedIndex} of `cls`, built on first use
+        """
+        s_class = cls.__name__
+        if self.sorted_by_class.get(s_class) is None:
+            objs = list(DATA.get(s_class, {}).values())
+            indexes = {}
+            for attr in getattr(cls, 'sorted_attributes', ()):
+                normalize = parse_timestamp if attr in TIMESTAMP_FIELDS \
+                    else None
+                indexes[attr] = SortedIndex(attr, normalize)
+                indexes[attr].add_many(objs)
+            self.sorted_by_class[s_class] = indexes
+        return self.sorted_by_class[s_class]
+
+    def reindex(self, cls: type):
+        """ Rebuild every index of `cls` from DATA
+        Sorted indexes are rebuilt on their next use
+        """
+        self.indexes_by_class.pop(cls.__name__, None)
+        self.sorted_by_class.pop(cls.__name__, None)
+        self.indexes(cls)
+
+    def journal(self, cls: type) -> Journal:
+        """ Return the Journal of `cls`
+        """
+        s_class = cls.__name__
+        if self.journals.get(s_class) is None:
+            self.journals[s_class] = Journal(
+                ".db_{}.journal".format(s_class))
+        return self.journals[s_class]
+
+    def load(self, cls: type):
+        """ Load all objects from file, then replay the journal
+        Objects changed in DATA but not written yet keep their version
+        """
+        s_class = cls.__name__
+        # Deferred saves would otherwise be lost by the reload
+        self.flusher.flush(cls)
+        journal = self.journal(cls)
+        objs = {}
+        coherence = coherent()
+        # A running compaction swaps the snapshot and journal files
+        with journal.compaction:
+            # Coherence compares the JSON form of objects with the file
+            native = not coherence
+            build = partial(Record, native=native) if lazy_loading() \
+                else (lambda raw: cls(**raw))
+            shared = self.lock_file(cls).shared() if coherence \
+                else nullcontext()
+            # No snapshot write or change of DATA can land between the
+            # read and the swap
+            with self.file_lock(cls), shared, self.lock(cls).write():
+                current = self.stamp(cls)
+                snapshot = self.read_snapshots(self.source_paths(cls),
+                                               native)
+                for obj_json in snapshot.values():
+                    obj = build(obj_json)
+                    objs[obj.id] = obj
+
+                replayed = journal.exists()
+                for op, payload in journal.replay():
+                    if op == "save":
+                        obj = build(payload)
+                        objs[obj.id] = obj
+                    else:
+                        objs.pop(payload, None)
+
+                # Their snapshot write is waiting for file_lock
+                stored = DATA.get(s_class, {})
+                for obj_id in self.pending.get(s_class, ()):
+                    if obj_id in stored:
+                        objs[obj_id] = stored[obj_id]
+                    else:
+                        objs.pop(obj_id, None)
+                DATA[s_class] = objs
+                self.reindex(cls)
+                dirty = self.dirty_shards.setdefault(s_class, set())
+                if replayed:
+                    # Shards the journal changed must be rewritten by
+                    # compaction
+                    dirty.update(range(shard_count()))
+                if coherence:
+                    self.synced[s_class] = snapshot
+                    self.stamps[s_class] = current
+        if replayed and not journaled():
+            # Fold the journal in so plain snapshots stay authoritative
+            self.compact(cls)
+
+    @staticmethod
+    def read_snapshot(file_path: str, native: bool = False) -> dict:
+        """ Return the decoded snapshot file, {} if there is none
+        Timestamps of binary snapshots are datetime values if `native`
+        """
+        if not path.exists(file_path) or path.getsize(file_path) == 0:
+            return {}
+        binary = file_path.endswith(".bin")
+        if not mmap_loading():
+            with open(file_path, 'rb' if binary else 'r') as f:
+                data = f.read()
+        else:
+            with open(file_path, 'rb') as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                data = mm[:]
+        if binary:
+            return {raw['id']: raw for raw in decode(data, native)}
+        return json.loads(data)
+
+    def read_snapshots(self, paths: List[str], native: bool = False) -> dict:
+        """ Return the union of the snapshot files `paths`, read in
+        parallel when there are several
+        """
+        if len(paths) == 1:
+            return self.read_snapshot(paths[0], native)
+        snapshot = {}
+        with ThreadPoolExecutor() as pool:
+            for part in pool.map(partial(self.read_snapshot, native=native),
+                                 paths):
+                snapshot.update(part)
+        return snapshot
+
+    def hydrate(self, cls: type, obj):
+        """ Return the instance stored under obj.id, building it from a
+        Record if needed (None if the object was removed meanwhile)
+        """
+        if type(obj) is not Record:
+            return obj
+        with self.lock(cls).write():
+            objs = DATA[cls.__name__]
+            current = objs.get(obj.id)
+            if type(current) is Record:
+                current = cls(**current.raw)
+                objs[obj.id] = current
+        return current
+
+    def snapshot(self, cls: type) -> list:
+        """ Return a consistent copy of the objects of `cls`
+        """
+        with self.lock(cls).read():
+            return list(DATA[cls.__name__].values())
+
+    def take(self, cls: type) -> Tuple[list, set]:
+        """ Return a consistent copy of the objects of `cls` and the
+        shards changed since the last take
+        """
+        with self.lock(cls).read():
+            self.pending.pop(cls.__name__, None)
+            return (list(DATA[cls.__name__].values()),
+                    self.dirty_shards.pop(cls.__name__, set()))
+
+    def touch(self, cls: type, ids: Iterable[str]):
+        """ Record the shards of `ids` as changed, and `ids` as not
+        written yet unless the journal holds them
+        The caller holds the write lock of `cls`
+        """
+        ids = list(ids)
+        if not journaled():
+            self.pending.setdefault(cls.__name__, set()).update(ids)
+        count = shard_count()
+        if count > 1:
+            dirty = self.dirty_shards.setdefault(cls.__name__, set())
+            dirty.update(shard_of(obj_id, count) for obj_id in ids)
+
+    def dump_shards(self, cls: type, objs: list, shards: set):
+        """ Write the snapshot files of `shards` from `objs`, every
+        object of `cls`; the only file when there is one shard
+        A failed write leaves its shards marked as changed
+        """
+        paths = self.file_paths(cls)
+        if len(paths) == 1:
+            self.dump(objs, paths[0])
+            return
+        parts = partition(objs, len(paths))
+        try:
+            for shard in sorted(shards):
+                self.dump(parts[shard], paths[shard])
+        except BaseException:
+            with self.lock(cls).write():
+                dirty = self.dirty_shards.setdefault(cls.__name__, set())
+                dirty.update(shards)
+            raise
+
+    @staticmethod
+    def dump(objs: list, file_path: str):
+        """ Replace `file_path` with the snapshot of `objs` atomically,
+        on disk when it returns unless MODEL_FSYNC is "never"
+        """
+        if file_path.endswith(".bin"):
+            data = encode([obj.to_native() for obj in objs], compression())
+        else:
+            # One dumps() call runs the C encoder, dump() streams through
+            # the pure Python one
+            data = json.dumps({obj.id: obj.to_json(True) for obj in objs})
+        atomic_write(file_path, data, fsync_policy() != "never")
+
+    def write(self, cls: type):
+        """ Write the snapshot file of `cls`
+        Writes are serialized, so a later snapshot is never replaced by an
+        older one; a write whose changes were already covered by a
+        snapshot taken after it was requested returns immediately
+        """
+        s_class = cls.__name__
+        with self.locks_lock:
+            ticket = self.requested.get(s_class, 0) + 1
+            self.requested[s_class] = ticket
+        with self.file_lock(cls):
+            if self.written.get(s_class, 0) >= ticket:
+                return
+            with self.locks_lock:
+                covered = self.requested[s_class]
+            self.flusher.clear(cls)
+            if coherent():
+                self.merge(cls)
+            else:
+                self.dump_shards(cls, *self.take(cls))
+            self.written[s_class] = covered
+
+    def merge(self, cls: type):
+        """ Write the snapshot of `cls` over the one on disk, keeping what
+        other processes wrote since this one last synced
+        The caller holds file_lock(cls)
+        """
+        s_class = cls.__name__
+        with self.lock_file(cls).exclusive():
+            if self.stamp(cls) != self.stamps.get(s_class):
+                self.sync(cls, self.read_snapshots(self.file_paths(cls)))
+            objs, shards = self.take(cls)
+            self.dump_shards(cls, objs, shards)
+            self.synced[s_class] = {obj.id: obj.to_json(True) for obj in objs}
+            self.stamps[s_class] = self.stamp(cls)
+
+    def sync(self, cls: type, snapshot: dict):
+        """ Apply to DATA what another process changed in `snapshot`
+        Objects this process changed or removed since the last sync keep
+        its version: the last process to write an object wins
+        """
+        s_class = cls.__name__
+        synced = self.synced.get(s_class, {})
+        build = Record if lazy_loading() else (lambda raw: cls(**raw))
+        with self.lock(cls).write():
+            objs = DATA.setdefault(s_class, {})
+            indexes = list(self.indexes(cls).values())
+            indexes.extend(self.sorted_by_class.get(s_class, {}).values())
+            local = {obj_id for obj_id, obj in objs.items()
+                     if obj.to_json(True) != synced.get(obj_id)}
+            local.update(obj_id for obj_id in synced if obj_id not in objs)
+            for obj_id, raw in snapshot.items():
+                if obj_id in local or synced.get(obj_id) == raw:
+                    continue
+                obj = build(raw)
+                objs[obj_id] = obj
+                for index in indexes:
+                    index.add(obj)
+            for obj_id in synced:
+                if obj_id not in snapshot and obj_id not in local:
+                    objs.pop(obj_id, None)
+                    for index in indexes:
+                        index.discard(obj_id)
+            self.synced[s_class] = snapshot
+
+    def refresh(self, cls: type):
+        """ Reload the snapshot of `cls` if another process replaced it
+        """
+        if not coherent():
+            return
+        s_class = cls.__name__
+        if self.stamp(cls) == self.stamps.get(s_class):
+            return
+        with self.file_lock(cls), self.lock_file(cls).shared():
+            current = self.stamp(cls)
+            if current != self.stamps.get(s_class):
+                self.sync(cls, self.read_snapshots(self.file_paths(cls)))
+                self.stamps[s_class] = current
+
+    def save_all(self, cls: type):
+        """ Save all objects to file, every shard
+        In journal mode this compacts the journal into the snapshot
+        """
+        with self.lock(cls).write():
+            self.dirty_shards[cls.__name__] = set(range(shard_count()))
+        if journaled():
+            self.compact(cls)
+        else:
+            self.write(cls)
+
+    def compact(self, cls: type, wait: bool = True):
+        """ Fold the journal into a fresh snapshot
+        With wait=False the snapshot is written by a background thread,
+        and nothing happens if a compaction is already running
+        """
+        s_class = cls.__name__
+        journal = self.journal(cls)
+        if not journal.compaction.acquire(blocking=wait):
+            return
+        try:
+            journal.rotate()
+            # Coherence writes go through merge(), which takes its own
+            taken = None if coherent() else self.take(cls)
+        except BaseException:
+            journal.compaction.release()
+            raise
+
+        def _compact():
+            """ Write the snapshot, then drop the journal it covers """
+            try:
+                if taken is None:
+                    self.write(cls)
+                else:
+                    with self.file_lock(cls):
+                        self.dump_shards(cls, *taken)
+                journal.discard_rotated()
+            finally:
+                journal.compaction.release()
+
+        if wait:
+            _compact()
+        else:
+            threading.Thread(target=_compact,
+                             name="compact-{}".format(s_class)).start()
+
+    def log(self, cls: type, op: str, objs: List[TypeVar('Base')]) -> bool:
+        """ Append the mutation `op` of `objs` to the journal in journal
+        mode, in one write; return whether it is due for compaction
+        The caller holds the write lock of `cls`, so the journal follows
+        the order in which mutations changed DATA
+        """
+        if not journaled():
+            return False
+        if op == "save":
+            records = [(op, obj.to_json(True)) for obj in objs]
+        else:
+            records = [(op, obj.id) for obj in objs]
+        return self.journal(cls).extend(records) >= threshold()
+
+    def persist(self, cls: type, due: bool):
+        """ Persist the mutations of `cls` according to the storage mode:
+        a compaction of the journal if `due`, a flush mark or a snapshot
+        write
+        The caller released the write lock of `cls`
+        """
+        if journaled():
+            if due:
+                self.compact(cls, wait=False)
+        elif flush_interval() > 0:
+            self.flusher.mark(cls)
+        else:
+            self.write(cls)
+
+    def save(self, obj: TypeVar('Base')):
+        """ Store one object in DATA and persist it
+        """
+        self.save_many([obj])
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Drop one object from DATA and persist the removal
+        """
+        self.remove_many(obj.__class__, [obj.id])
+
+    def save_many(self, objs: List[TypeVar('Base')]):
+        """ Store objects in DATA, then persist each class once
+        """
+        by_class = {}
+        for obj in objs:
+            by_class.setdefault(obj.__class__, []).append(obj)
+        for cls, group in by_class.items():
+            with self.lock(cls).write():
+                stored = DATA[cls.__name__]
+                indexes = self.indexes(cls).values()
+                for obj in group:
+                    stored[obj.id] = obj
+                    for index in indexes:
+                        index.add(obj)
+                self.touch(cls, (obj.id for obj in group))
+                sorted_indexes = self.sorted_by_class.get(cls.__name__, {})
+                for index in sorted_indexes.values():
+                    index.add_many(group)
+                due = self.log(cls, "save", group)
+            self.persist(cls, due)
+
+    def remove_many(self, cls: type, ids: List[str]) -> List[bool]:
+        """ Drop objects from DATA by ID, then persist the removals once
+        Return, per ID, whether an object was removed
+        """
+        results, removed = [], []
+        with self.lock(cls).write():
+            stored = DATA[cls.__name__]
+            indexes = list(self.indexes(cls).values())
+            indexes.extend(self.sorted_by_class.get(cls.__name__, {}).values())
+            for obj_id in ids:
+                obj = stored.pop(obj_id, None)
+                results.append(obj is not None)
+                if obj is None:
+                    continue
+                removed.append(obj)
+                for index in indexes:
+                    index.discard(obj_id)
+            self.touch(cls, (obj.id for obj in removed))
+            due = bool(removed) and self.log(cls, "remove", removed)
+        if removed:
+            self.persist(cls, due)
+        return results
+
+    def flush(self, cls: Optional[type] = None):
+        """ Write pending deferred saves now
+        """
+        self.flusher.flush(cls)
+
+    def count(self, cls: type) -> int:
+        """ Count all objects
+        """
+        self.refresh(cls)
+        return len(DATA[cls.__name__].keys())
+
+    def get(self, cls: type, id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        self.refresh(cls)
+        return self.hydrate(cls, DATA[cls.__name__].get(id))
+
+    def candidates(self, cls: type, attributes: dict,
+                   order_by: Optional[str] = None,
+                   needed: Optional[int] = None
+                   ) -> Tuple[Optional[list], bool]:
+        """ Plan a search: return (ids, ordered), the ids worth testing
+        against `attributes` (None to test every object) and whether
+        they already follow `order_by`
+        The smallest hash bucket or sorted index span wins; a sorted
+        index on the order_by attribute also yields the ids in order,
+        and only the first `needed` of them when it alone decides the
+        matches. The caller holds the read lock of `cls`
+        """
+        indexes = self.indexes(cls)
+        attribute = None if order_by is None else order_by.lstrip('-')
+        sorted_attributes = getattr(cls, 'sorted_attributes', ())
+        if attribute in sorted_attributes or any(
+                isinstance(v, Predicate) for v in attributes.values()):
+            sorted_indexes = self.sorted_indexes(cls)
+        else:
+            sorted_indexes = {}
+
+        best, best_size = None, None
+        for k, v in attributes.items():
+            if isinstance(v, Predicate):
+                if k not in sorted_indexes:
+                    continue
+                index = sorted_indexes[k]
+                try:
+                    start, stop = span(index, v)
+                except (TypeError, ValueError):
+                    continue
+                source = (index, start, stop)
+                size = stop - start + len(index.others)
+            elif k in indexes:
+                try:
+                    source = indexes[k].lookup(v)
+                except TypeError:
+                    continue
+                size = len(source)
+            else:
+                continue
+            if best is None or size < best_size:
+                best, best_size = source, size
+
+        index = sorted_indexes.get(attribute)
+        if index is not None and (best is None or (
+                type(best) is tuple and best[0] is index)):
+            start, stop = (0, len(index.keys)) if best is None \
+                else best[1:]
+            reverse = order_by.startswith('-')
+            alone = not attributes if best is None else all(
+                k == attribute for k in attributes)
+            if alone and needed is not None:
+                if reverse:
+                    start = max(start, stop - needed)
+                else:
+                    stop = min(stop, start + needed)
+            ids = list(index.ids(start, stop, reverse))
+            # None (and unordered) values sort last, first when reversed
+            others = list(index.others)
+            return (others + ids if reverse else ids + others), True
+        if best is None:
+            return None, False
+        if type(best) is tuple:
+            index, start, stop = best
+            return list(index.ids(start, stop)) + list(index.others), False
+        return list(best), False
+
+    def matching(self, cls: type, attributes: dict,
+                 order_by: Optional[str] = None,
+                 needed: Optional[int] = None
+                 ) -> Tuple[Iterator[TypeVar('Base')], bool]:
+        """ Return (objects, ordered): an iterator over the objects with
+        matching attributes, and whether it already follows `order_by`
+        Objects come in DATA order unless an index decides the order
+        """
+        self.refresh(cls)
+        # Copies, so callers and other threads may save or remove while
+        # the results are consumed
+        with self.lock(cls).read():
+            objs = DATA[cls.__name__]
+            ids, ordered = self.candidates(cls, attributes, order_by,
+                                           needed)
+            if ids is None:
+                candidates = list(objs.values())
+            else:
+                candidates = [objs.get(obj_id) for obj_id in ids]
+        return self.filtered(cls, candidates, attributes), ordered
+
+    def filtered(self, cls: type, candidates: list,
+                 attributes: dict) -> Iterator[TypeVar('Base')]:
+        """ Yield the hydrated candidates matching `attributes`
+        """
+        for obj in candidates:
+            obj = self.hydrate(cls, obj)
+            if obj is not None and matches(obj, attributes):
+                yield obj
+
+    def iter_search(self, cls: type, attributes: dict,
+                    limit: Optional[int] = None, offset: int = 0,
+                    order_by: Optional[str] = None
+                    ) -> Iterator[TypeVar('Base')]:
+        """ Search objects with matching attributes lazily
+        Iteration stops as soon as `limit` objects matched, unless
+        order_by names an attribute without a sorted index
+        """
+        needed = None if limit is None else offset + limit
+        objs, ordered = self.matching(cls, attributes, order_by, needed)
+        return page(objs, limit, offset, None if ordered else order_by)
+
+    def iter_values(self, cls: type,
+                    attribute: str) -> Iterator[Tuple[str, object]]:
+        """ Yield (id, value of `attribute`) for every object of `cls`
+        Records are read as they are, without hydrating them
+        """
+        self.refresh(cls)
+        with self.lock(cls).read():
+            objs = list(DATA[cls.__name__].values())
+        for obj in objs:
+            yield obj.id, getattr(obj, attribute, None)
+
+
+def get_storage() -> Storage:
+    """ Return the backend selected by MODEL_STORAGE
+    """
+    name = getenv("MODEL_STORAGE", "json").lower()
+    if STORAGES.get(name) is None:
+        if name == "json":
+            STORAGES[name] = JSONStorage()
+        elif name == "sqlite":
+            from models.sqlite_storage import SQLiteStorage
+            STORAGES[name] = SQLiteStorage(
+                getenv("MODEL_SQLITE_PATH", ".db.sqlite3"))
+        else:
+            raise ValueError("unknown MODEL_STORAGE: {}".format(name))
+    return STORAGES[name]
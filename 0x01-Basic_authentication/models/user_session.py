@@ -7,6 +7,8 @@ from models.base import Base
 class UserSession(Base):
     """ User class
     """
+    __slots__ = ('user_id', 'session_id')
+    indexed_attributes = ('session_id', 'user_id')
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance"""
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+""" Change the number of snapshot shards of model classes
+
+    ./reshard.py 8 User UserSession
+
+rewrites the `.db_<Class>.*` snapshot of each class in the current
+directory as 8 shard files (1 for the single `.db_<Class>.json`), in
+MODEL_SNAPSHOT_FORMAT, then removes the old files. Journals are kept:
+they replay over any layout. Stop the API first, and run it with
+MODEL_SHARDS set to the new count afterwards.
+"""
+from os import path
+import os
+import sys
+from models.shards import layouts, partition, shard_paths
+from models.snapshot import snapshot_format
+from models.storage import JSONStorage, Record
+from models.timestamps import TIMESTAMP_FIELDS, parse_timestamp
+
+
+def reshard(s_class: str, count: int) -> int:
+    """ Rewrite the snapshot of class `s_class` in `count` shards
+    Return the object count
+    """
+    extension = "bin" if snapshot_format() == "binary" else "json"
+    target = (count, extension)
+    sources = [layout for layout in layouts(s_class) if layout != target]
+    if not sources:
+        raise ValueError("{}: nothing to reshard".format(s_class))
+    if len(sources) > 1:
+        raise ValueError("{}: several snapshots found {}, remove the stale "
+                         "ones first".format(s_class, sources))
+    old_paths = shard_paths(s_class, sources[0][1], sources[0][0])
+
+    storage = JSONStorage()
+    snapshot = storage.read_snapshots(old_paths, native=True)
+    records = []
+    for raw in snapshot.values():
+        if extension == "bin":
+            # Native timestamps, as binary snapshots written by the API
+            for name in TIMESTAMP_FIELDS:
+                if type(raw.get(name)) is str:
+                    raw[name] = parse_timestamp(raw[name])
+        records.append(Record(raw, native=True))
+
+    new_paths = shard_paths(s_class, extension, count)
+    for records_shard, file_path in zip(partition(records, count),
+                                        new_paths):
+        storage.dump(records_shard, file_path)
+    for file_path in old_paths:
+        if file_path not in new_paths and path.exists(file_path):
+            os.remove(file_path)
+    return len(records)
+
+
+def main(argv: list) -> int:
+    """ Run the resharding described by `argv`, return the exit status
+    """
+    if len(argv) < 2 or not argv[0].isdigit() or int(argv[0]) < 1:
+        print(__doc__.strip(), file=sys.stderr)
+        return 2
+    count = int(argv[0])
+    for s_class in argv[1:]:
+        try:
+            total = reshard(s_class, count)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+        print("{}: {} objects -> {} shard(s)".format(s_class, total, count))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+""" Snapshot format benchmark
+
+Saves and loads N users with the JSON snapshot, the binary snapshot and
+the zlib-compressed binary snapshot, and prints the save time, load time
+(file to objects in DATA) and file size of each.
+
+Run it in a scratch directory, it writes `.db_User.*` files there.
+
+Usage: ./snapshot_benchmark.py [count ...]   (default: 10000 100000 1000000)
+"""
+from os import path
+import gc
+import os
+import sys
+import time
+from models.base import DATA
+from models.user import User
+
+FORMATS = (
+    ("json", {"MODEL_SNAPSHOT_FORMAT": "json"}),
+    ("binary", {"MODEL_SNAPSHOT_FORMAT": "binary"}),
+    ("binary+zlib", {"MODEL_SNAPSHOT_FORMAT": "binary",
+                     "MODEL_SNAPSHOT_COMPRESS": "1"}),
+)
+
+
+def make_users(count: int):
+    """ Fill DATA with `count` users, without saving them one by one
+    """
+    DATA['User'] = {}
+    for i in range(count):
+        user = User(email="user{}@example.com".format(i),
+                    first_name="First{}".format(i % 1000),
+                    last_name=None if i % 3 else "Last")
+        # Stored as its 64-character SHA-256 hex digest
+        user.password = "password{}".format(i)
+        DATA['User'][user.id] = user
+
+
+def timed(function) -> float:
+    """ Return the seconds one call of `function` takes
+    """
+    gc.collect()
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def run(count: int):
+    """ Print save/load time and file size of every format for `count`
+    users
+    """
+    make_users(count)
+    for name, env in FORMATS:
+        os.environ.pop("MODEL_SNAPSHOT_COMPRESS", None)
+        os.environ.update(env)
+        file_path = ".db_User.{}".format("json" if name == "json" else "bin")
+        save = timed(User.save_to_file)
+        size = path.getsize(file_path)
+        load = timed(User.load_from_file)
+        if User.count() != count:
+            raise AssertionError("loaded {} users".format(User.count()))
+        print("{:>9} {:<12} save {:8.3f}s  load {:8.3f}s  {:8.1f} MB".format(
+            count, name, save, load, size / 1e6))
+        os.remove(file_path)
+    DATA['User'] = {}
+
+
+if __name__ == "__main__":
+    counts = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    for count in counts:
+        run(count)
@@ -48,7 +48,7 @@ class SessionDBAuth(SessionExpAuth):
         if not session_id or type(session_id) is not str:
             return None
         try:
-            sessns = UserSession.search({"session_id": session_id})
+            sessns = UserSession.search({"session_id": session_id}, limit=1)
         except KeyError:
             return None
         if not sessns:
@@ -78,7 +78,7 @@ class SessionDBAuth(SessionExpAuth):
             return False
         sessId = self.session_cookie(request)
         try:
-            sessins = UserSession.search({"session_id": sessId})
+            sessins = UserSession.search({"session_id": sessId}, limit=1)
         except KeyError:
             return False
 
@@ -18,7 +18,8 @@ User.load_from_file()
 # Reloading sessions
 UserSession.load_from_file()
 try:
-    for session in UserSession.all():
-        SessionDBAuth.user_id_by_session_id[session.id] = session.user_id
+    # Raw values, so lazily loaded sessions are not built at startup
+    for session_id, user_id in UserSession.iter_values('user_id'):
+        SessionDBAuth.user_id_by_session_id[session_id] = user_id
 except KeyError:
     pass
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+""" Convert model snapshots between the JSON and binary formats
+
+    ./convert_snapshot.py to-binary User UserSession [--compress]
+    ./convert_snapshot.py to-json User UserSession
+
+converts `.db_<Class>.json` to `.db_<Class>.bin` (or back) in the
+current directory. Stop the API first: the other file is not removed,
+and whichever matches MODEL_SNAPSHOT_FORMAT is loaded.
+"""
+import sys
+from models.snapshot import binary_to_json, json_to_binary
+
+
+def main(argv: list) -> int:
+    """ Run the conversion described by `argv`, return the exit status
+    """
+    compress = "--compress" in argv
+    args = [arg for arg in argv if arg != "--compress"]
+    if len(args) < 2 or args[0] not in ("to-binary", "to-json"):
+        print(__doc__.strip(), file=sys.stderr)
+        return 2
+    for s_class in args[1:]:
+        json_path = ".db_{}.json".format(s_class)
+        binary_path = ".db_{}.bin".format(s_class)
+        if args[0] == "to-binary":
+            count = json_to_binary(json_path, binary_path, compress)
+            print("{}: {} objects -> {}".format(s_class, count, binary_path))
+        else:
+            count = binary_to_json(binary_path, json_path)
+            print("{}: {} objects -> {}".format(s_class, count, json_path))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+""" Coherence module
+
+Lets several processes share the `.db_<Class>.json` snapshots
+(MODEL_COHERENCE): writers hold an exclusive lock on `<snapshot>.lock`
+and merge their changes into the current file instead of overwriting
+it, and readers notice from its (inode, mtime, size) stamp that another
+process replaced the file, then reload what changed.
+"""
+from contextlib import contextmanager
+from os import getenv
+from typing import Optional, Tuple
+import os
+try:
+    import fcntl
+except ImportError:  # not a POSIX system
+    fcntl = None
+
+
+def coherent() -> bool:
+    """ Return True when MODEL_COHERENCE shares snapshots between processes
+    """
+    value = getenv("MODEL_COHERENCE", "")
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def stamp(file_path: str) -> Optional[Tuple[int, int, int]]:
+    """ Return (inode, mtime in ns, size) of `file_path`, None if missing
+    Snapshots are replaced by rename, so each write changes the inode
+    """
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class FileLock():
+    """ Advisory lock (flock) on `file_path`, shared by every process
+
+    flock locks belong to the open file, so threads of one process must
+    be serialized by the caller, and a forked child reopens the file
+    instead of sharing its parent's lock.
+    """
+
+    def __init__(self, file_path: str):
+        """ Initialize a FileLock on `file_path` (created on first use)
+        """
+        if fcntl is None:
+            raise RuntimeError("MODEL_COHERENCE needs fcntl (POSIX only)")
+        self.path = file_path
+        self._fd = None
+        self._pid = None
+
+    def fileno(self) -> int:
+        """ Return the lock file descriptor of the current process
+        """
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    @contextmanager
+    def _locked(self, operation: int):
+        """ Hold the lock with `operation` in a with block
+        """
+        fd = self.fileno()
+        fcntl.flock(fd, operation)
+        try:
+            yield self
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def shared(self):
+        """ Hold the lock for reading, concurrently with other readers
+        """
+        return self._locked(fcntl.LOCK_SH)
+
+    def exclusive(self):
+        """ Hold the lock for writing
+        """
+        return self._locked(fcntl.LOCK_EX)
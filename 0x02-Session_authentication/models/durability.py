@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+""" Durability module
+
+Snapshots are written to a per-process temporary file then renamed over
+the target, so a crash mid-write leaves the previous file intact.
+MODEL_FSYNC chooses what else reaches the disk before a write returns:
+
+    never      nothing; the OS writes back when it likes (default)
+    on-flush   snapshot files and their directory entry, each time a
+               snapshot is written (save_to_file, flushes, compactions)
+    always     on-flush, plus every journal append
+"""
+from os import getenv, path
+import os
+
+
+FSYNC_POLICIES = ("never", "on-flush", "always")
+
+
+def fsync_policy(default: str = "never") -> str:
+    """ Return the fsync policy from MODEL_FSYNC
+    """
+    name = getenv("MODEL_FSYNC", default).lower()
+    if name not in FSYNC_POLICIES:
+        raise ValueError("unknown MODEL_FSYNC: {}".format(name))
+    return name
+
+
+def fsync_directory(dir_path: str):
+    """ Make the entries of `dir_path` (a rename) durable
+    """
+    try:
+        fd = os.open(dir_path or ".", os.O_RDONLY)
+    except OSError:
+        # Directories can't be opened on every platform (Windows)
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(file_path: str, data, sync: bool = False):
+    """ Replace `file_path` with `data` (str or bytes) atomically
+    Readers see either the previous file or the new one, never a
+    partial write. With `sync` the data and the rename are on disk
+    when this returns
+    """
+    # Per process, so processes sharing the file never collide
+    tmp_path = "{}.{}.tmp".format(file_path, os.getpid())
+    try:
+        with open(tmp_path, 'wb' if type(data) is bytes else 'w') as f:
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if sync:
+        fsync_directory(path.dirname(file_path))
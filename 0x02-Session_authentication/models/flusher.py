@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+""" Flusher module
+
+Deferred persistence: save()/remove() only mark their class dirty and a
+background thread rewrites each dirty class at most once per interval.
+"""
+from os import getenv
+from typing import Callable
+import atexit
+import threading
+
+
+def flush_interval() -> float:
+    """ Seconds between background flushes, from MODEL_FLUSH_INTERVAL
+    0 (the default) keeps writing the file on every save()/remove()
+    """
+    return float(getenv("MODEL_FLUSH_INTERVAL", 0))
+
+
+class Flusher():
+    """ Coalesces snapshot writes of dirty model classes
+    """
+
+    def __init__(self, write: Callable[[type], None]):
+        """ Initialize an idle Flusher calling `write(cls)` per dirty class
+        """
+        self.write = write
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.flushing = threading.Lock()
+        self.thread = None
+        self.wakeup = threading.Event()
+        atexit.register(self.flush)
+
+    def mark(self, cls: type):
+        """ Schedule `cls` for the next background flush
+        """
+        with self.lock:
+            self.dirty.add(cls)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self._run, name="model-flusher", daemon=True)
+                self.thread.start()
+
+    def clear(self, cls: type):
+        """ Forget a pending flush of `cls` (its file is being written)
+        """
+        with self.lock:
+            self.dirty.discard(cls)
+
+    def flush(self, cls: type = None):
+        """ Write the dirty classes (or only `cls`) now
+        """
+        with self.flushing:
+            with self.lock:
+                if cls is None:
+                    pending, self.dirty = self.dirty, set()
+                elif cls in self.dirty:
+                    self.dirty.discard(cls)
+                    pending = {cls}
+                else:
+                    pending = set()
+            for dirty_cls in pending:
+                self.write(dirty_cls)
+
+    def _run(self):
+        """ Flush loop; exits once nothing is left to write
+        """
+        while True:
+            self.wakeup.wait(max(flush_interval(), 0.001))
+            self.flush()
+            with self.lock:
+                if not self.dirty:
+                    self.thread = None
+                    return
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+""" Query module
+
+Predicates usable as values of a search, next to plain values (which
+keep matching by equality):
+
+    UserSession.search({'created_at': Range(high=cutoff)})
+    User.search({'email': Prefix("bob@")}, order_by='email')
+
+Backends answer them from sorted indexes (see models.index.SortedIndex)
+or SQL when they can, and by testing every candidate otherwise.
+"""
+from datetime import datetime
+from typing import Optional
+from models.timestamps import parse_timestamp
+
+
+def coerce(value, like):
+    """ Return `value` comparable with `like`
+    Timestamps of not yet hydrated objects are still strings, and bounds
+    on timestamps may be given as TIMESTAMP_FORMAT strings. Raise
+    ValueError for a string that is not a timestamp
+    """
+    if type(like) is datetime and type(value) is str:
+        try:
+            return parse_timestamp(value)
+        except ValueError:
+            raise ValueError("{!r} is not a timestamp".format(value))
+    return value
+
+
+class Predicate():
+    """ A condition on one attribute, other than equality
+    """
+
+    def match(self, value) -> bool:
+        """ Return True if `value` satisfies the predicate
+        """
+        raise NotImplementedError()
+
+
+class Range(Predicate):
+    """ low <= value < high by default; either bound may be None (open)
+    Bounds on timestamps are datetime values or TIMESTAMP_FORMAT strings
+    """
+
+    def __init__(self, low=None, high=None, include_low: bool = True,
+                 include_high: bool = False):
+        """ Initialize a Range between `low` and `high`
+        """
+        self.low = low
+        self.high = high
+        self.include_low = include_low
+        self.include_high = include_high
+
+    def match(self, value) -> bool:
+        """ Return True if `value` lies in the range
+        """
+        if value is None:
+            return False
+        value = coerce(value, self.low if self.low is not None
+                       else self.high)
+        low, high = coerce(self.low, value), coerce(self.high, value)
+        try:
+            if low is not None and (
+                    value < low if self.include_low else value <= low):
+                return False
+            if high is not None and (
+                    value > high if self.include_high else value >= high):
+                return False
+        except TypeError:
+            return False
+        return True
+
+    def __repr__(self) -> str:
+        """ Interval notation, e.g. Range[a, b)
+        """
+        return "Range{}{!r}, {!r}{}".format(
+            "[" if self.include_low else "(", self.low, self.high,
+            "]" if self.include_high else ")")
+
+
+class Prefix(Predicate):
+    """ Strings starting with `prefix`
+    """
+
+    def __init__(self, prefix: str):
+        """ Initialize a Prefix predicate
+        """
+        self.prefix = prefix
+
+    def match(self, value) -> bool:
+        """ Return True if `value` is a string starting with the prefix
+        """
+        return type(value) is str and value.startswith(self.prefix)
+
+    def upper(self) -> Optional[str]:
+        """ Return the smallest string above every match, None if there
+        is none (the prefix is empty or ends with the last code point)
+        """
+        prefix = self.prefix.rstrip(chr(0x10FFFF))
+        if not prefix:
+            return None
+        return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+    def __repr__(self) -> str:
+        """ Prefix('...')
+        """
+        return "Prefix({!r})".format(self.prefix)
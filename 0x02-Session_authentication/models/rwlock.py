@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+""" Readers-writer lock module
+"""
+from contextlib import contextmanager
+import threading
+
+
+class RWLock():
+    """ Many concurrent readers or a single writer
+
+    Waiting writers block new readers, so a steady stream of reads
+    cannot starve writes. The lock is reentrant per thread: a reader may
+    read again, and a writer may read or write again. A reader cannot
+    upgrade to a writer.
+    """
+
+    def __init__(self):
+        """ Initialize an unlocked lock
+        """
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = {}
+        self.writer = None
+        self.depth = 0
+        self.waiting = 0
+
+    def acquire_read(self):
+        """ Block until the calling thread may read
+        """
+        me = threading.get_ident()
+        with self.condition:
+            if self.writer != me and me not in self.readers:
+                while self.writer is not None or self.waiting:
+                    self.condition.wait()
+            self.readers[me] = self.readers.get(me, 0) + 1
+
+    def release_read(self):
+        """ Release one read acquisition of the calling thread
+        """
+        me = threading.get_ident()
+        with self.condition:
+            depth = self.readers[me] - 1
+            if depth:
+                self.readers[me] = depth
+                return
+            del self.readers[me]
+            if not self.readers:
+                self.condition.notify_all()
+
+    def acquire_write(self):
+        """ Block until the calling thread is the only one holding the lock
+        """
+        me = threading.get_ident()
+        with self.condition:
+            if self.writer == me:
+                self.depth += 1
+                return
+            if me in self.readers:
+                raise RuntimeError("cannot upgrade a read lock")
+            self.waiting += 1
+            try:
+                while self.writer is not None or self.readers:
+                    self.condition.wait()
+            finally:
+                self.waiting -= 1
+            self.writer = me
+            self.depth = 1
+
+    def release_write(self):
+        """ Release one write acquisition of the calling thread
+        """
+        with self.condition:
+            if self.writer != threading.get_ident():
+                raise RuntimeError("write lock not held by this thread")
+            self.depth -= 1
+            if not self.depth:
+                self.writer = None
+                self.condition.notify_all()
+
+    @contextmanager
+    def read(self):
+        """ Hold the lock for reading in a with block
+        """
+        self.acquire_read()
+        try:
+            yield self
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        """ Hold the lock for writing in a with block
+        """
+        self.acquire_write()
+        try:
+            yield self
+        finally:
+            self.release_write()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+""" Timestamps module
+
+Text codec of the created_at/updated_at attributes, shared by the models
+and the storage backends.
+"""
+from datetime import datetime
+
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+TIMESTAMP_FIELDS = ('created_at', 'updated_at')
+
+
+def parse_timestamp(value: str) -> datetime:
+    """ Parse a TIMESTAMP_FORMAT string
+    datetime.fromisoformat is an order of magnitude faster than strptime
+    and reads exactly this layout; anything else goes through strptime.
+    datetime values (binary snapshots store them natively) are returned
+    as is
+    """
+    if type(value) is datetime:
+        return value
+    if len(value) == 19 and value[4] == '-' and value[7] == '-' \
+            and value[10] == 'T':
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+def format_timestamp(value: datetime) -> str:
+    """ Format a datetime as TIMESTAMP_FORMAT
+    """
+    if value.tzinfo is None and value.year >= 1000:
+        return value.isoformat(timespec='seconds')
+    return value.strftime(TIMESTAMP_FORMAT)
@@ -8,6 +8,9 @@ from models.base import Base
 class UserSession(Base):
     """ session object representing user session info
     """
+    __slots__ = ('user_id', 'session_id')
+    indexed_attributes = ('session_id', 'user_id')
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize UserSession instance
         """
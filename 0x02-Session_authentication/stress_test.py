@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+""" Multi-threaded stress test of the model storage
+
+Writer threads create, update and remove users, reader threads search
+and count them, and a saver thread keeps rewriting the snapshot file
+with save_to_file(), as a threaded WSGI server would do. Every thread
+checks its own invariants; at the end the file is reloaded and must
+hold exactly the users left in memory.
+
+Run it in a scratch directory, it writes `.db_User.json` there.
+
+Usage: ./stress_test.py [threads] [operations per thread]
+"""
+import sys
+import threading
+import time
+from models.user import User
+
+
+def writer(number: int, operations: int, errors: list):
+    """ Create users, update half of them and remove a third
+    """
+    try:
+        for i in range(operations):
+            user = User(email="w{}-{}@example.com".format(number, i))
+            user.save()
+            if i % 2 == 0:
+                user.first_name = "updated"
+                user.save()
+            if i % 3 == 0:
+                user.remove()
+            elif User.get(user.id) is not user:
+                raise AssertionError("saved user not found by id")
+    except Exception as e:
+        errors.append(e)
+
+
+def reader(stop: threading.Event, errors: list):
+    """ Search and count until told to stop
+    """
+    try:
+        while not stop.is_set():
+            for user in User.search({'first_name': "updated"}):
+                if user.first_name != "updated":
+                    raise AssertionError("search returned a non-match")
+            User.count()
+            User.search({'email': "w0-0@example.com"}, limit=1)
+    except Exception as e:
+        errors.append(e)
+
+
+def saver(stop: threading.Event, errors: list):
+    """ Rewrite the snapshot file until told to stop
+    """
+    try:
+        while not stop.is_set():
+            User.save_to_file()
+    except Exception as e:
+        errors.append(e)
+
+
+def run(threads: int, operations: int) -> int:
+    """ Run the stress test, return the process exit status
+    """
+    User.load_from_file()
+    for user in User.all():
+        user.remove()
+    errors, stop = [], threading.Event()
+    writers = [threading.Thread(target=writer, args=(n, operations, errors))
+               for n in range(threads)]
+    others = [threading.Thread(target=reader, args=(stop, errors))
+              for _ in range(threads)]
+    others.append(threading.Thread(target=saver, args=(stop, errors)))
+
+    start = time.perf_counter()
+    for thread in writers + others:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for thread in others:
+        thread.join()
+    User.flush()
+
+    expected = threads * (operations - (operations + 2) // 3)
+    in_memory = {user.id for user in User.all()}
+    User.save_to_file()
+    User.load_from_file()
+    if len(in_memory) != expected:
+        errors.append(AssertionError("{} users in memory, expected {}"
+                                     .format(len(in_memory), expected)))
+    if {user.id for user in User.all()} != in_memory:
+        errors.append(AssertionError("reloaded file differs from memory"))
+
+    print("{} writer threads x {} operations: {:.0f} ops/s".format(
+        threads, operations, threads * operations / elapsed))
+    for e in errors:
+        print("FAILED: {!r}".format(e))
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    operations = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    sys.exit(run(threads, operations))